@@ -0,0 +1,187 @@
+"""
+Local stand-ins for the CERM export API and the ARIA GraphQL data manager, used by the
+benchmark harness. Both servers can add latency, fail a fraction of the requests with
+503 and throttle with 429 above a given number of requests per second.
+"""
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+
+CERM_SECRET = 'benchmark-secret-key-that-is-long-enough-for-hs256'
+ARIA_OPERATION = re.compile(r'(?:(\w+)\s*:\s*)?(createData(?:Bucket|Record|Field))\(input:\s*\$(\w+)\)')
+
+
+class Behaviour:
+    """
+    Latency, error and throttling settings of a fake server, plus its request counters
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.requests = 0
+        self.operations = 0
+        self.errors = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """
+        Sleeps the configured latency and returns the HTTP status to fail with, if any
+        """
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            if self.throttle:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 1]
+                if len(self._window) >= self.throttle:
+                    self.throttled += 1
+                    return 429
+                self._window.append(now)
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return 503
+        return None
+
+    def stats(self):
+        return {'requests': self.requests, 'operations': self.operations, 'errors': self.errors,
+                'throttled': self.throttled}
+
+    def reset_max_in_flight(self):
+        with self._lock:
+            self.max_in_flight = self.in_flight
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_cerm_server(samples_by_visit, behaviour=None, port=0):
+    """
+    Function that serves /auth/login and /fandango/export/json/PID{vid} for the given samples
+
+    Args:
+        samples_by_visit (dict): visit id (str) -> samples list
+        behaviour (Behaviour): latency/errors/throttling
+        port (int): port to listen on, 0 picks a free one
+
+    Returns:
+        ThreadingHTTPServer: running server, its url is http://127.0.0.1:{server.server_port}
+    """
+
+    behaviour = behaviour or Behaviour()
+    bodies = {}
+    for vid, samples in samples_by_visit.items():
+        body = json.dumps({'visit': vid, 'samples': samples}).encode('utf-8')
+        bodies[vid] = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+
+    class CermHandler(_Handler):
+        def do_POST(self):
+            self.read_json()
+            status = behaviour.admit()
+            if status:
+                return self.send_empty(status)
+            token = jwt.encode({'sub': 'benchmark', 'exp': int(time.time()) + 3600}, CERM_SECRET, algorithm='HS256')
+            self.send_json(200, {'token': token})
+
+        def do_GET(self):
+            status = behaviour.admit()
+            if status:
+                return self.send_empty(status)
+            vid = self.path.rsplit('PID', 1)[-1]
+            if vid not in bodies:
+                return self.send_empty(404)
+            body, etag = bodies[vid]
+            if self.headers.get('If-None-Match') == etag:
+                return self.send_empty(304)
+            behaviour.operations += 1
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return _serve(CermHandler, port, behaviour)
+
+
+def start_aria_server(behaviour=None, port=0):
+    """
+    Function that serves the createDataBucket/Record/Field mutations used by fGOaria,
+    including documents with several aliased mutations
+
+    Args:
+        behaviour (Behaviour): latency/errors/throttling
+        port (int): port to listen on, 0 picks a free one
+
+    Returns:
+        ThreadingHTTPServer: running server, its url is http://127.0.0.1:{server.server_port}
+    """
+
+    behaviour = behaviour or Behaviour()
+    ids = itertools.count(1)
+    ids_lock = threading.Lock()
+
+    class AriaHandler(_Handler):
+        def do_POST(self):
+            payload = self.read_json()
+            status = behaviour.admit()
+            if status:
+                return self.send_empty(status)
+            data = {}
+            for alias, operation, variable in ARIA_OPERATION.findall(payload.get('query', '')):
+                with ids_lock:
+                    entity_id = f"{operation[len('createData'):].lower()}-{next(ids)}"
+                    behaviour.operations += 1
+                item = dict(payload.get('variables', {}).get(variable, {}))
+                item.update({'id': entity_id, 'owner': 'benchmark', 'created': time.time(), 'updated': time.time()})
+                data[alias or operation] = item
+            self.send_json(200, {'data': data})
+
+    return _serve(AriaHandler, port, behaviour)
+
+
+def _serve(handler, port, behaviour):
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.behaviour = behaviour
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
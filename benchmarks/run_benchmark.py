@@ -0,0 +1,218 @@
+"""
+Offline end-to-end benchmark of the plugin: synthetic visits are served by a local CERM
+stand-in, exported with generate-experiment-metadata and uploaded with send-metadata to a
+local ARIA stand-in. Reports wall time, throughput and peak memory of each phase.
+
+Run from the repository root; the database and the exports go to a temporary directory:
+
+    python -m benchmarks.run_benchmark --samples 50 --datasets 2 --experiments 10 \
+        --latency 0.02 --error-rate 0.05 --throttle 200 --workers 8 --batch-size 20
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_servers import Behaviour, CERM_SECRET, start_aria_server, start_cerm_server
+from benchmarks.synthetic import count_nodes, make_samples
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of generate-experiment-metadata and send-metadata')
+    data = parser.add_argument_group('synthetic data')
+    data.add_argument('--visits', type=int, default=1, help='number of visits to export and upload')
+    data.add_argument('--samples', type=int, default=10, help='samples per visit')
+    data.add_argument('--datasets', type=int, default=2, help='datasets per sample')
+    data.add_argument('--experiments', type=int, default=5, help='experiments per dataset')
+    data.add_argument('--payload-bytes', type=int, default=256, help='free-text bytes per experiment')
+    servers = parser.add_argument_group('fake servers')
+    servers.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    servers.add_argument('--jitter', type=float, default=0.0, help='random extra seconds added to every request')
+    servers.add_argument('--error-rate', type=float, default=0.0, help='fraction of ARIA requests answered with 503')
+    servers.add_argument('--cerm-error-rate', type=float, default=0.0, help='fraction of CERM requests answered with 503')
+    servers.add_argument('--throttle', type=int, default=None, help='ARIA requests per second above which 429 is returned')
+    plugin = parser.add_argument_group('plugin')
+    plugin.add_argument('--parallel', type=int, default=None, help='concurrent exports (generate-experiment-metadata)')
+    plugin.add_argument('--format', dest='storage_format', default=None,
+                        help='storage format of the exported samples (json, gzip, zstd, msgpack)')
+    plugin.add_argument('--workers', type=int, default=None, help='upload workers (send-metadata)')
+    plugin.add_argument('--rate', type=float, default=None, help='initial ARIA requests per second')
+    plugin.add_argument('--burst', type=int, default=None, help='ARIA request burst')
+    plugin.add_argument('--batch-size', type=int, default=None, help='Records/Fields per ARIA request')
+    plugin.add_argument('--async', dest='use_async', action='store_true',
+                        help='use the asyncio export/upload path (needs aiohttp)')
+    plugin.add_argument('--projects-parallel', type=int, default=None,
+                        help='projects uploaded at the same time when there are several visits (schedule-send-metadata)')
+    plugin.add_argument('--max-requests', type=int, default=None,
+                        help='concurrent ARIA requests over all projects (schedule-send-metadata)')
+    plugin.add_argument('--circuit', default=None, help='circuit breaker mode: fail-fast, pause or off')
+    plugin.add_argument('--failure-rate', type=float, default=None,
+                        help='fraction of failed ARIA requests that opens the circuit')
+    plugin.add_argument('--max-field-size', type=int, default=None, help='largest JSON field pushed as it is, in bytes')
+    plugin.add_argument('--oversized', default=None, help='oversized fields policy: split or externalise')
+    plugin.add_argument('--rerun', action='store_true', help='repeat both phases to measure the unchanged/delta path')
+    output = parser.add_argument_group('output')
+    output.add_argument('--verbose', action='store_true', help='show the plugin output')
+    output.add_argument('--json', dest='json_out', help='also write the report to this JSON file')
+    return parser.parse_args(argv)
+
+
+def configure_environment(cerm_url, aria_url, workdir):
+    """Points the plugin at the fake servers and workdir; must run before the plugin modules are imported"""
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        f.write(f"[DDBB]\nDDBB_PATH = {workdir}\n\n[METADATA]\nOUTPUT_PATH = {os.path.join(workdir, 'output')}\n")
+    os.environ.update({
+        'NMRCERM_CONFIG': config_path,
+        'CERM_BASE_URL': cerm_url,
+        'CERM_USERNAME': 'benchmark',
+        'CERM_PASSWORD': 'benchmark',
+        'CERM_API_DECODE': CERM_SECRET,
+        'CERM_PERSIST_TOKEN': 'false',
+        'DEV': 'BENCHMARK',
+        'ARIA_GQL_BENCHMARK': aria_url,
+    })
+
+
+class BenchmarkAriaClient:
+    """AriaClient replacement that skips the OAuth login and talks to the fake data manager"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def login(self):
+        pass
+
+    def new_data_manager(self, entity_id, entity_type, populate):
+        from fGOaria import DataManager
+        return DataManager('benchmark-token', entity_id, entity_type, populate)
+
+
+def measure(phase, func, quiet):
+    """
+    Runs func and returns its result with wall time and the peak of Python allocations
+    """
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        result = func()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    return result, {'phase': phase, 'wall_s': round(wall, 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def run(args):
+    samples_by_visit = {str(vid): make_samples(args.samples, args.datasets, args.experiments, args.payload_bytes, seed=vid)
+                        for vid in range(1, args.visits + 1)}
+    cerm = start_cerm_server(samples_by_visit, Behaviour(args.latency, args.jitter, args.cerm_error_rate))
+    aria = start_aria_server(Behaviour(args.latency, args.jitter, args.error_rate, args.throttle))
+    workdir = tempfile.mkdtemp(prefix='nmrcerm-benchmark-')
+    configure_environment(f'http://127.0.0.1:{cerm.server_port}', f'http://127.0.0.1:{aria.server_port}', workdir)
+
+    from nmrcerm.actions import generate_experiment_metadata, send_metadata, schedule_send_metadata
+    from nmrcerm.utils.metrics import metrics
+
+    send_metadata.AriaClient = BenchmarkAriaClient
+
+    vids = list(samples_by_visit)
+    projects = ['benchmark'] if len(vids) == 1 else [f'benchmark_{vid}' for vid in vids]
+    nodes = count_nodes(args.samples, args.datasets, args.experiments) * len(vids)
+
+    def export(force):
+        return generate_experiment_metadata.perform_action({
+            'name': 'benchmark', 'vid': ','.join(vids), 'parallel': args.parallel, 'force': force,
+            'format': args.storage_format, 'use_async': args.use_async})
+
+    def upload(delta):
+        options = {'workers': args.workers, 'rate': args.rate, 'burst': args.burst, 'batch_size': args.batch_size,
+                   'delta': delta, 'use_async': args.use_async, 'circuit': args.circuit,
+                   'failure_rate': args.failure_rate, 'max_field_size': args.max_field_size,
+                   'oversized': args.oversized}
+        if len(projects) == 1:
+            return [send_metadata.perform_action(dict(options, name=projects[0]))]
+        result = schedule_send_metadata.perform_action(dict(options, projects=','.join(projects),
+                                                            parallel=args.projects_parallel,
+                                                            max_requests=args.max_requests))
+        if not isinstance(result['info'], dict):
+            return [result]
+        return [{'success': status['success'], 'info': status} for status in result['info']['projects'].values()]
+
+    passes = [('initial', True, False)] + ([('rerun', False, True)] if args.rerun else [])
+    tracemalloc.start()
+    phases = []
+    for label, force, delta in passes:
+        for name, func in ((f'export ({label})', lambda: export(force)), (f'upload ({label})', lambda: upload(delta))):
+            metrics.reset()
+            server = 'cerm' if name.startswith('export') else 'aria'
+            behaviour = (cerm if server == 'cerm' else aria).behaviour
+            before = behaviour.stats()
+            behaviour.reset_max_in_flight()
+            result, phase = measure(name, func, not args.verbose)
+            results = result if isinstance(result, list) else [result]
+            delta_stats = {key: value - before[key] for key, value in behaviour.stats().items()}
+            phase.update({
+                'success': all(r['success'] for r in results),
+                'server': server,
+                'requests': delta_stats['requests'],
+                'operations': delta_stats['operations'],
+                'errors_injected': delta_stats['errors'],
+                'throttled': delta_stats['throttled'],
+                'max_in_flight': behaviour.max_in_flight,
+                'requests_per_sec': round(delta_stats['requests'] / phase['wall_s'], 2) if phase['wall_s'] else None,
+                'ops_per_sec': round(delta_stats['operations'] / phase['wall_s'], 2) if phase['wall_s'] else None,
+                'metrics': metrics.summary(),
+            })
+            if server == 'aria':
+                phase['nodes'] = nodes
+                phase['failed_operations'] = sum(count_failures(r['info']) for r in results)
+            if not phase['success']:
+                phase['errors'] = [r['info'] for r in results if not r['success']]
+            phases.append(phase)
+    tracemalloc.stop()
+
+    return {
+        'parameters': vars(args),
+        'phases': phases,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'workdir': workdir,
+    }
+
+
+def count_failures(info):
+    """Failed operations of a send-metadata result (a list) or of a scheduler project status (a count)"""
+    failures = info.get('failed_operations') if isinstance(info, dict) else None
+    return failures if isinstance(failures, int) else len(failures or [])
+
+
+def print_report(report):
+    header = (f"{'phase':<18}{'ok':<4}{'wall s':>9}{'requests':>10}{'ops':>8}{'ops/s':>10}{'errors':>8}{'429':>6}"
+              f"{'in flight':>11}{'peak MB':>9}")
+    print(header)
+    print('-' * len(header))
+    for phase in report['phases']:
+        print(f"{phase['phase']:<18}{'✓' if phase['success'] else '✗':<4}{phase['wall_s']:>9.3f}"
+              f"{phase['requests']:>10}{phase['operations']:>8}{phase['ops_per_sec'] or 0:>10.1f}"
+              f"{phase['errors_injected']:>8}{phase['throttled']:>6}{phase['max_in_flight']:>11}{phase['peak_mb']:>9.2f}")
+        for error in phase.get('errors', []):
+            print(f"    ✗ {error}")
+    print(f"Max RSS: {report['max_rss_mb']} MB, data kept in {report['workdir']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return 0 if all(phase['success'] for phase in report['phases']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
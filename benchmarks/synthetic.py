@@ -0,0 +1,57 @@
+"""
+Synthetic CERM samples shaped like the export consumed by the plugin: samples with an
+experimentDTO list of datasets, each with an experimentList of experiments.
+"""
+import random
+import string
+from typing import Any, Dict, List
+
+
+def make_samples(samples: int = 10, datasets: int = 2, experiments: int = 5, payload_bytes: int = 256,
+                 seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Function that generates a reproducible list of samples
+
+    Args:
+        samples (int): number of samples
+        datasets (int): datasets (experimentDTO entries) per sample
+        experiments (int): experiments per dataset
+        payload_bytes (int): approximate size of the free-text parameters of each experiment
+        seed (int): random seed
+
+    Returns:
+        list: samples
+    """
+
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + ' '
+
+    def text(size):
+        return ''.join(rng.choice(alphabet) for _ in range(size))
+
+    result = []
+    for s in range(samples):
+        result.append({
+            'name': f'SAMPLE_{s:05d}',
+            'description': text(32),
+            'concentration': round(rng.uniform(0.1, 5.0), 3),
+            'buffer': {'ph': round(rng.uniform(5.5, 8.0), 2), 'salt': 'NaCl', 'd2o_percent': 10},
+            'experimentDTO': [{
+                'id': s * datasets + d + 1,
+                'spectrometer': f'AVANCE_{rng.choice((600, 700, 800, 950))}',
+                'temperature': round(rng.uniform(278, 310), 1),
+                'experimentList': [{
+                    'expno': e + 1,
+                    'pulprog': rng.choice(('zg30', 'hsqcetgpsi', 'noesygpph', 'cosygpqf')),
+                    'ns': rng.choice((8, 16, 32, 64)),
+                    'td': [rng.choice((1024, 2048, 4096)), rng.choice((128, 256))],
+                    'parameters': text(payload_bytes),
+                } for e in range(experiments)],
+            } for d in range(datasets)],
+        })
+    return result
+
+
+def count_nodes(samples: int, datasets: int, experiments: int) -> int:
+    """Number of Records (and of Fields) the upload of such samples creates"""
+    return samples * (1 + datasets * (1 + experiments))
@@ -1,6 +1,28 @@
+import importlib
 import core
-from nmrcerm.constants import ACTION_GENERATE_EXPERIMENT_METADATA, ACTION_SEND_METADATA, ACTION_PRINT_PROJECT
-from nmrcerm.actions import generate_experiment_metadata, send_metadata, print_project
+from nmrcerm.constants import ACTION_GENERATE_EXPERIMENT_METADATA, ACTION_SEND_METADATA, ACTION_PRINT_PROJECT, \
+    ACTION_SCHEDULE_SEND_METADATA, DEFAULT_SCHEDULER_PARALLELISM, DEFAULT_HOST_CONCURRENCY, \
+    DEFAULT_UPLOAD_WORKERS, DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, DEFAULT_EXPORT_PARALLELISM, \
+    DEFAULT_BATCH_SIZE, METADATA_FORMATS, DEFAULT_METADATA_FORMAT, DEFAULT_CIRCUIT_MODE, CIRCUIT_FAIL_FAST, \
+    CIRCUIT_PAUSE, CIRCUIT_OFF, CIRCUIT_FAILURE_RATE, DEFAULT_MAX_FIELD_BYTES, PAYLOAD_SPLIT, PAYLOAD_EXTERNALISE, \
+    DEFAULT_OVERSIZED_PAYLOAD
+
+
+def lazy_action(module_name):
+    """
+    Function that returns the perform_action of nmrcerm.actions.<module_name>, importing the
+    module (and its dependencies: requests, fGOaria, tabulate...) only when the action runs
+
+    Args:
+        module_name (str): action module name
+
+    Returns:
+        callable: perform_action(args)
+    """
+
+    def perform_action(args):
+        return importlib.import_module(f'nmrcerm.actions.{module_name}').perform_action(args)
+    return perform_action
 
 
 class Plugin(core.Plugin):
@@ -9,18 +31,202 @@ class Plugin(core.Plugin):
     def define_args(cls):
 
         cls.define_arg(ACTION_GENERATE_EXPERIMENT_METADATA, {
-            'help': {'usage': '--vid PROJECT_ID',
-                     'epilog': '--vid 129'},
+            'help': {'usage': '--vid PROJECT_ID[,PROJECT_ID|FIRST-LAST...] [--vid_file PATH] [--parallel N] [--force] '
+                              '[--format FORMAT] [--use_async] [--metrics_out PATH]',
+                     'epilog': '--vid 129  or  --vid 129,131,140-150 --parallel 8 --format gzip'},
+            'args': {
+                'vid': {'help': 'ARIA visit id, or a comma separated list/range of them. With several visits '
+                                'each one is stored as project NAME_VID',
+                        'required': False
+                        },
+                'vid_file': {'help': 'file with visit ids (one id, list or range per line)',
+                             'required': False
+                             },
+                'parallel': {'help': f'maximum number of exports fetched at the same time '
+                                     f'(default {DEFAULT_EXPORT_PARALLELISM})',
+                             'required': False
+                             },
+                'force': {'help': 'download and rewrite the export even if the visit did not change',
+                          'required': False,
+                          'action': 'store_true'
+                          },
+                'format': {'help': f'storage format of the exported samples: {", ".join(METADATA_FORMATS)} '
+                                   f'(default {DEFAULT_METADATA_FORMAT}, zstd and msgpack need the zstandard/msgpack '
+                                   f'packages)',
+                           'required': False
+                           },
+                'use_async': {'help': 'with several visits, fetch the exports from one asyncio event loop instead '
+                                      'of threads (needs aiohttp)',
+                              'required': False,
+                              'action': 'store_true'
+                              },
+                'metrics_out': {'help': 'write latency/throughput metrics to this file (JSON, or Prometheus text '
+                                        'if it ends in .prom)',
+                                'required': False
+                                }
+            }
+        })
+
+        cls.define_arg(ACTION_SEND_METADATA, {
+            'help': {'usage': '[--workers N] [--rate REQUESTS_PER_SECOND] [--burst N] [--batch_size N] [--resume | --delta] '
+                              '[--use_async] [--circuit MODE] [--failure_rate RATE] [--max_field_size BYTES] '
+                              '[--oversized POLICY] [--metrics_out PATH]',
+                     'epilog': '--workers 8 --rate 10 --burst 10 --batch_size 50 --delta --circuit pause'},
+            'args': {
+                'workers': {'help': f'maximum number of concurrent ARIA pushes (default {DEFAULT_UPLOAD_WORKERS})',
+                            'required': False
+                            },
+                'rate': {'help': f'initial ARIA requests per second, adapted to failures (default {DEFAULT_RATE_LIMIT})',
+                         'required': False
+                         },
+                'burst': {'help': f'maximum ARIA requests sent back to back (default {DEFAULT_RATE_BURST})',
+                          'required': False
+                          },
+                'batch_size': {'help': f'maximum sibling Records or Fields sent in one ARIA request, 1 disables '
+                                       f'batching (default {DEFAULT_BATCH_SIZE})',
+                               'required': False
+                               },
+                'resume': {'help': 'reuse the last bucket and skip the nodes already uploaded to it',
+                           'required': False,
+                           'action': 'store_true'
+                           },
+                'delta': {'help': 'only push the samples, datasets and experiments that are new or changed '
+                                  'since the last upload',
+                          'required': False,
+                          'action': 'store_true'
+                          },
+                'use_async': {'help': 'push from one asyncio event loop instead of worker threads, --workers is '
+                                      'then the number of concurrent pushes (needs aiohttp)',
+                              'required': False,
+                              'action': 'store_true'
+                              },
+                'circuit': {'help': f'when failure_rate of the recent ARIA requests failed: {CIRCUIT_FAIL_FAST} '
+                                    f'skips the remaining pushes, {CIRCUIT_PAUSE} waits for ARIA to come back, '
+                                    f'{CIRCUIT_OFF} retries every push (default {DEFAULT_CIRCUIT_MODE})',
+                            'required': False
+                            },
+                'failure_rate': {'help': f'fraction of failed ARIA requests that opens the circuit '
+                                         f'(default {CIRCUIT_FAILURE_RATE})',
+                                 'required': False
+                                 },
+                'max_field_size': {'help': f'largest JSON field pushed as it is, in bytes '
+                                           f'(default {DEFAULT_MAX_FIELD_BYTES})',
+                                   'required': False
+                                   },
+                'oversized': {'help': f'larger fields are {PAYLOAD_SPLIT} into several fields of the same record '
+                                      f'(a value too large for one field fails the node), or their largest values '
+                                      f'are {PAYLOAD_EXTERNALISE}d to local sidecar files, not uploaded, under '
+                                      f'the metadata OUTPUT_PATH (default {DEFAULT_OVERSIZED_PAYLOAD})',
+                              'required': False
+                              },
+                'metrics_out': {'help': 'write latency/throughput metrics to this file (JSON, or Prometheus text '
+                                        'if it ends in .prom)',
+                                'required': False
+                                }
+            }
+        })
+
+        cls.define_arg(ACTION_SCHEDULE_SEND_METADATA, {
+            'help': {'usage': '[--projects NAME[,NAME...]] [--parallel N] [--max_requests N] [--workers N] '
+                              '[--rate REQUESTS_PER_SECOND] [--burst N] [--batch_size N] [--resume | --delta] '
+                              '[--circuit MODE] [--failure_rate RATE] [--max_field_size BYTES] [--oversized POLICY] '
+                              '[--metrics_out PATH]',
+                     'epilog': '--projects nmr_129,nmr_130 --parallel 4  or, for every exported project not '
+                               'uploaded yet,  --parallel 4 --max_requests 16'},
+            'args': {
+                'projects': {'help': 'comma separated FandanGO projects to upload (default: every project with a '
+                                     'metadata_path and no successful upload since its last export)',
+                             'required': False
+                             },
+                'parallel': {'help': f'maximum number of projects uploaded at the same time '
+                                     f'(default {DEFAULT_SCHEDULER_PARALLELISM})',
+                             'required': False
+                             },
+                'max_requests': {'help': f'maximum number of concurrent requests to each ARIA host, over all '
+                                         f'projects (default {DEFAULT_HOST_CONCURRENCY})',
+                                 'required': False
+                                 },
+                'workers': {'help': f'maximum number of concurrent ARIA pushes of each project '
+                                    f'(default {DEFAULT_UPLOAD_WORKERS})',
+                            'required': False
+                            },
+                'rate': {'help': f'initial ARIA requests per second of each project (default {DEFAULT_RATE_LIMIT})',
+                         'required': False
+                         },
+                'burst': {'help': f'maximum ARIA requests sent back to back by each project '
+                                  f'(default {DEFAULT_RATE_BURST})',
+                          'required': False
+                          },
+                'batch_size': {'help': f'maximum sibling Records or Fields sent in one ARIA request '
+                                       f'(default {DEFAULT_BATCH_SIZE})',
+                               'required': False
+                               },
+                'resume': {'help': 'reuse the last bucket of each project and skip the nodes already uploaded',
+                           'required': False,
+                           'action': 'store_true'
+                           },
+                'delta': {'help': 'only push what is new or changed since the last upload of each project',
+                          'required': False,
+                          'action': 'store_true'
+                          },
+                'circuit': {'help': f'when failure_rate of the recent ARIA requests of all projects failed: {CIRCUIT_FAIL_FAST} '
+                                    f'skips the remaining pushes, {CIRCUIT_PAUSE} waits for ARIA to come back, '
+                                    f'{CIRCUIT_OFF} retries every push (default {DEFAULT_CIRCUIT_MODE})',
+                            'required': False
+                            },
+                'failure_rate': {'help': f'fraction of failed ARIA requests that opens the circuit '
+                                         f'(default {CIRCUIT_FAILURE_RATE})',
+                                 'required': False
+                                 },
+                'max_field_size': {'help': f'largest JSON field pushed as it is, in bytes '
+                                           f'(default {DEFAULT_MAX_FIELD_BYTES})',
+                                   'required': False
+                                   },
+                'oversized': {'help': f'larger fields are {PAYLOAD_SPLIT} into several fields of the same record '
+                                      f'(a value too large for one field fails the node), or their largest values '
+                                      f'are {PAYLOAD_EXTERNALISE}d to local sidecar files, not uploaded, under '
+                                      f'the metadata OUTPUT_PATH (default {DEFAULT_OVERSIZED_PAYLOAD})',
+                              'required': False
+                              },
+                'metrics_out': {'help': 'write latency/throughput metrics of the whole run to this file (JSON, or '
+                                        'Prometheus text if it ends in .prom)',
+                                'required': False
+                                }
+            }
+        })
+
+        cls.define_arg(ACTION_PRINT_PROJECT, {
+            'help': {'usage': '[--summary] [--results] [--type TYPE] [--status STATUS] [--run RUN_ID] [--limit N]',
+                     'epilog': '--summary  or  --type experiment --status failed --limit 20'},
             'args': {
-                'vid': {'help': 'ARIA visit id',
-                        'required': True
-                        }
+                'summary': {'help': 'show the last bucket, the upload runs and the node counts per type and status',
+                            'required': False,
+                            'action': 'store_true'
+                            },
+                'results': {'help': 'list the uploaded nodes with their ARIA record and field ids',
+                            'required': False,
+                            'action': 'store_true'
+                            },
+                'type': {'help': 'only list nodes of this type: sample, dataset or experiment',
+                         'required': False
+                         },
+                'status': {'help': 'only list nodes with this status: created, updated or failed',
+                           'required': False
+                           },
+                'run': {'help': 'upload run to summarise or list (default: last run for the summary, all runs '
+                                'for the list)',
+                        'required': False
+                        },
+                'limit': {'help': 'maximum number of runs or nodes listed',
+                          'required': False
+                          }
             }
         })
 
 
     @classmethod
     def define_methods(cls):
-        cls.define_method(ACTION_GENERATE_EXPERIMENT_METADATA, generate_experiment_metadata.perform_action)
-        cls.define_method(ACTION_SEND_METADATA, send_metadata.perform_action)
-        cls.define_method(ACTION_PRINT_PROJECT, print_project.perform_action)
\ No newline at end of file
+        cls.define_method(ACTION_GENERATE_EXPERIMENT_METADATA, lazy_action('generate_experiment_metadata'))
+        cls.define_method(ACTION_SEND_METADATA, lazy_action('send_metadata'))
+        cls.define_method(ACTION_PRINT_PROJECT, lazy_action('print_project'))
+        cls.define_method(ACTION_SCHEDULE_SEND_METADATA, lazy_action('schedule_send_metadata'))
\ No newline at end of file
@@ -1,55 +1,57 @@
-import configparser
+import asyncio
 import os
-import json
 import requests
 import jwt
-import pprint as pp
-from typing import List, Dict, Any
-from dotenv import load_dotenv
-from nmrcerm.db.sqlite_db import update_project
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from nmrcerm.constants import DEFAULT_EXPORT_PARALLELISM, DEFAULT_METADATA_FORMAT
+from nmrcerm.db.sqlite_db import update_project_values, get_export_cache, save_export_cache
+from nmrcerm.utils.samples_io import write_samples, iter_export_samples, metadata_extension, write_samples_async, \
+    iter_export_samples_async
+from nmrcerm.utils.token_cache import TokenCache
+from nmrcerm.utils.validation import SampleValidator
+from nmrcerm.utils.metrics import metrics
+from nmrcerm.utils.config import get_env, get_setting
+from nmrcerm.utils.async_http import create_async_session, http_status
 
-load_dotenv()
+metadata_server = get_env("CERM_BASE_URL")
+user = get_env('CERM_USERNAME')
+password = get_env('CERM_PASSWORD')
+api_decode = get_env('CERM_API_DECODE')
+# opt-in: a persisted token is stored unencrypted in the shared plugin database
+persist_token = get_env('CERM_PERSIST_TOKEN', 'false').lower() in ('1', 'true', 'yes')
 
-metadata_server = os.getenv("CERM_BASE_URL")
-user = os.getenv('CERM_USERNAME')
-password = os.getenv('CERM_PASSWORD')
-api_decode = os.getenv('CERM_API_DECODE')
+token_cache = TokenCache(persist_token)
 
-config = configparser.ConfigParser()
-config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'config.yaml'))
-metadata_output_path = config['METADATA'].get('OUTPUT_PATH')
+metadata_output_path = get_setting('METADATA', 'OUTPUT_PATH')
 
-def generate_experiment_metadata(project_name: str, vid: str) -> Dict[str, Any]:
+def generate_experiment_metadata(project_name: str, vid: str, use_cache: bool = True,
+                                 metrics_out: str = None,
+                                 storage_format: str = DEFAULT_METADATA_FORMAT) -> Dict[str, Any]:
     """
     Function that generates metadata for a FandanGO project based on external system
 
     Args:
         project_name (str): FandanGO project name
         vid (str): Visit ID for the project
+        use_cache (bool): skip the rewrite when the visit did not change since the last export
+        metrics_out (str): file where the latency summary is written (.prom for Prometheus text)
+        storage_format (str): how the samples are stored: json (compact), gzip, zstd or msgpack
         
     Returns:
         Dict: Dictionary containing success status and metadata info
     """
     try:
         print(f"user:{user}")
-        print(f"password:{password}")
-        token = login(user, password)
-        
-        api_response = call_protected(token, vid)
+        token = get_token()
         
         token_info = decode(token)
-        
-        json_path = f"{metadata_output_path}/project_{project_name}_{vid}.json"
-        os.makedirs(os.path.dirname(json_path), exist_ok=True)
-        
-        
-        with open(json_path, 'w') as f:
-            json.dump(api_response["samples"], f, indent=2)
 
         success = True
-        update_project(project_name, 'visit_id', vid)
-        update_project(project_name, 'metadata_path', json_path)
-        info = {"metadata_path": json_path}
+        info = export_visit(project_name, vid, use_cache=use_cache, storage_format=storage_format)
+        info['metrics'] = metrics.summary()
+        if metrics_out:
+            metrics.write(metrics_out)
 
     except Exception as e:
         success = False
@@ -57,22 +59,286 @@ def generate_experiment_metadata(project_name: str, vid: str) -> Dict[str, Any]:
 
     return success, info
 
-def login(username: str, password: str) -> str:
-    r = requests.post(f"{metadata_server}/auth/login", json={"username": username, "password": password}, verify=False)
+def generate_batch_experiment_metadata(project_name: str, vids: List[str],
+                                       parallel: int = DEFAULT_EXPORT_PARALLELISM,
+                                       use_cache: bool = True, metrics_out: str = None,
+                                       storage_format: str = DEFAULT_METADATA_FORMAT,
+                                       use_async: bool = False) -> Dict[str, Any]:
+    """
+    Function that generates metadata for several visits with a single login and a pooled session
+
+    Args:
+        project_name (str): FandanGO project name, each visit is stored as project "{project_name}_{vid}"
+        vids (list): Visit IDs to export
+        parallel (int): maximum number of exports fetched at the same time
+        use_cache (bool): skip the rewrite of visits that did not change since their last export
+        metrics_out (str): file where the latency summary is written (.prom for Prometheus text)
+        storage_format (str): how the samples are stored: json (compact), gzip, zstd or msgpack
+        use_async (bool): fetch the exports from an asyncio event loop (needs aiohttp) instead of threads
+
+    Returns:
+        Dict: Dictionary containing success status and, per visit, metadata info or error
+    """
+    info = {'visits': {}}
+    try:
+        parallel = max(1, min(int(parallel), len(vids)))
+        metadata_extension(storage_format)
+        if use_async:
+            info['visits'] = asyncio.run(export_visits_async(project_name, vids, parallel, use_cache, storage_format))
+            success = all(visit['success'] for visit in info['visits'].values())
+            info['metrics'] = metrics.summary()
+            if metrics_out:
+                metrics.write(metrics_out)
+            return success, info
+
+        session = create_session(parallel)
+        token_info = decode(get_token(session))
+
+        def export(vid):
+            try:
+                return vid, True, export_visit(f"{project_name}_{vid}", vid, session, use_cache, storage_format)
+            except Exception as e:
+                metrics.increment('export_failures')
+                print(f"✗ Visit {vid} could not be exported: {e}")
+                return vid, False, str(e)
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for vid, visit_success, visit_info in executor.map(export, vids):
+                info['visits'][vid] = {'success': visit_success, 'info': visit_info}
+
+        success = all(visit['success'] for visit in info['visits'].values())
+        info['metrics'] = metrics.summary()
+        if metrics_out:
+            metrics.write(metrics_out)
+
+    except Exception as e:
+        success = False
+        info = str(e)
+
+    return success, info
+
+def export_visit(project_name: str, vid: str, session: requests.Session = None, use_cache: bool = True,
+                 storage_format: str = DEFAULT_METADATA_FORMAT) -> Dict[str, Any]:
+    json_path, cached = _export_target(project_name, vid, use_cache, storage_format)
+    token = get_token(session)
+    try:
+        export = call_protected(token, vid, json_path, session, cached)
+    except Exception as e:
+        if not _token_rejected(vid, e):
+            raise
+        export = call_protected(get_token(session, rejected=token), vid, json_path, session, cached)
+    return _export_saved(project_name, vid, json_path, export)
+
+def _export_target(project_name: str, vid: str, use_cache: bool,
+                   storage_format: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Returns:
+        tuple: file the visit is exported to and its cached export, None if it must be fetched again
+    """
+    # the extension records the storage format, readers pick the decoder from it
+    json_path = f"{metadata_output_path}/project_{project_name}_{vid}{metadata_extension(storage_format)}"
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+    cached = get_export_cache(vid) if use_cache else None
+    if cached and (cached['metadata_path'] != json_path or not os.path.exists(json_path)):
+        cached = None
+    return json_path, cached
+
+def _token_rejected(vid: str, error: Exception) -> bool:
+    """Tells if CERM answered 401, in which case the export is retried once with a new token"""
+    if http_status(error) != 401:
+        return False
+    metrics.increment('token_rejected')
+    print(f"Token rejected for visit {vid}, logging in again...")
+    return True
+
+def _export_saved(project_name: str, vid: str, json_path: str, export: Dict[str, Any]) -> Dict[str, Any]:
+    """Records a finished export in the project and the export cache"""
+    if not export['changed']:
+        print(f"Visit {vid} unchanged since last export, keeping {json_path}")
+        return {"metadata_path": json_path, "unchanged": True}
+
+    print(f"Samples exported for visit {vid}: {export['samples']}")
+    print_upload_plan(vid, export)
+    update_project_values(project_name, {'visit_id': vid, 'metadata_path': json_path})
+    save_export_cache(vid, json_path, export['etag'], export['last_modified'], export['content_hash'])
+    return {"metadata_path": json_path, "plan": export['plan']}
+
+def print_upload_plan(vid: str, export: Dict[str, Any]):
+    for warning in export['warnings']:
+        print(f"⚠ Visit {vid}: {warning}")
+    plan = export['plan']
+    print(f"Upload plan for visit {vid}: {plan['samples']} samples, {plan['datasets']} datasets, "
+          f"{plan['experiments']} experiments ({plan['nodes']} nodes)")
+    if plan['duplicates_removed']:
+        print(f"↷ Repeated entries dropped from visit {vid}: {plan['duplicates_removed']}")
+
+async def export_visits_async(project_name: str, vids: List[str], parallel: int = DEFAULT_EXPORT_PARALLELISM,
+                              use_cache: bool = True,
+                              storage_format: str = DEFAULT_METADATA_FORMAT) -> Dict[str, Dict[str, Any]]:
+    """
+    Exports several visits from one event loop, with at most parallel exports in flight over
+    a pooled aiohttp session. Each visit is stored as project "{project_name}_{vid}".
+
+    Returns:
+        dict: per visit, success and metadata info or error
+    """
+    semaphore = asyncio.Semaphore(parallel)
+    async with create_async_session(parallel, verify_ssl=False) as session:
+        decode(await get_token_async(session))
+
+        async def export(vid):
+            async with semaphore:
+                try:
+                    return vid, True, await export_visit_async(f"{project_name}_{vid}", vid, session, use_cache,
+                                                               storage_format)
+                except Exception as e:
+                    metrics.increment('export_failures')
+                    print(f"✗ Visit {vid} could not be exported: {e}")
+                    return vid, False, str(e)
+
+        results = await asyncio.gather(*(export(vid) for vid in vids))
+    return {vid: {'success': visit_success, 'info': visit_info} for vid, visit_success, visit_info in results}
+
+async def export_visit_async(project_name: str, vid: str, session, use_cache: bool = True,
+                             storage_format: str = DEFAULT_METADATA_FORMAT) -> Dict[str, Any]:
+    """Same as export_visit, through an aiohttp session"""
+    json_path, cached = _export_target(project_name, vid, use_cache, storage_format)
+    token = await get_token_async(session)
+    try:
+        export = await call_protected_async(token, vid, json_path, session, cached)
+    except Exception as e:
+        if not _token_rejected(vid, e):
+            raise
+        export = await call_protected_async(await get_token_async(session, rejected=token), vid, json_path, session,
+                                            cached)
+    return _export_saved(project_name, vid, json_path, export)
+
+def create_session(pool_size: int = DEFAULT_EXPORT_PARALLELISM) -> requests.Session:
+    """Session whose connection pool can serve pool_size concurrent requests to CERM"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = False
+    return session
+
+def parse_vids(vid: str = None, vid_file: str = None) -> List[str]:
+    """
+    Expands visit IDs given as "129", "129,130", "129-140" (or a mix of them), and/or read
+    from a file with one such entry per line ("#" starts a comment). Order is kept, duplicates dropped.
+    """
+    entries = []
+    if vid:
+        entries.extend(str(vid).split(','))
+    if vid_file:
+        with open(vid_file) as f:
+            for line in f:
+                entries.extend(line.split('#', 1)[0].split(','))
+
+    vids = []
+    for entry in (e.strip() for e in entries):
+        if not entry:
+            continue
+        if '-' in entry:
+            try:
+                first, last = (int(v) for v in entry.split('-', 1))
+            except ValueError:
+                raise ValueError(f"invalid visit id range '{entry}', use FIRST-LAST (e.g. 129-140)")
+            vids.extend(str(v) for v in range(first, last + 1))
+        else:
+            vids.append(entry)
+    return list(dict.fromkeys(vids))
+
+def get_token(session: requests.Session = None, rejected: str = None) -> str:
+    """Cached CERM token, logging in only when there is no valid one (or the cached one was rejected)"""
+    return token_cache.get_token(metadata_server, user, lambda: login(user, password, session), rejected)
+
+async def get_token_async(session, rejected: str = None) -> str:
+    """Same as get_token, logging in through an aiohttp session"""
+    return await token_cache.get_token_async(metadata_server, user, lambda: login_async(user, password, session),
+                                             rejected)
+
+@metrics.timed('login')
+def login(username: str, password: str, session: requests.Session = None) -> str:
+    r = (session or requests).post(f"{metadata_server}/auth/login", json={"username": username, "password": password}, verify=False)
     #r = requests.post(f"{BASE_URL}/auth/login",json={"username": username, "password": password}, verify="spring.crt")
     r.raise_for_status()
     token = r.json()["token"]
     print("Token JWT ottenuto:", token)
     return token
 
-def call_protected(token: str, vid: str) -> Dict[str, Any]:
+@metrics.timed('call_protected')
+def call_protected(token: str, vid: str, json_path: str, session: requests.Session = None,
+                   cached: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Streams the visit export and writes its samples to json_path without loading the whole
+    response in memory. With a cached export, the request is conditional (ETag/Last-Modified)
+    and the file is only rewritten if the server reports a change and the content differs.
+    Samples are validated and normalised on the way (see SampleValidator): a malformed
+    export raises ExportValidationError and leaves the previous file in place.
+    """
+    with (session or requests).get(f"{metadata_server}/fandango/export/json/PID{vid}",
+                                   headers=_conditional_headers(token, cached), verify=False, stream=True) as r:
+        #r = requests.get(f"{BASE_URL}/fandango/export/json", headers=headers, verify="spring.crt")
+        r.raise_for_status()
+        if r.status_code == 304:
+            return _not_modified()
+        r.raw.decode_content = True
+        previous_hash = cached['content_hash'] if cached else None
+        validator = SampleValidator()
+        samples_count, content_hash = write_samples(json_path, validator.validate(iter_export_samples(r.raw)),
+                                                    previous_hash)
+        return _export_result(validator, samples_count, content_hash, previous_hash, r.headers)
+
+def _conditional_headers(token: str, cached: Dict[str, Any] = None) -> Dict[str, str]:
+    """Headers of the export request: conditional (ETag/Last-Modified) when there is a cached export"""
     headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(f"{metadata_server}/fandango/export/json/PID{vid}", headers=headers, verify=False)
-    #r = requests.get(f"{BASE_URL}/fandango/export/json", headers=headers, verify="spring.crt")
-    r.raise_for_status()
-    print("Risposta API:", r.text)
-    pp.pprint(r.text)
-    return r.json()  
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+def _not_modified() -> Dict[str, Any]:
+    metrics.increment('export_not_modified')
+    return {'changed': False, 'samples': None}
+
+def _export_result(validator: SampleValidator, samples_count: int, content_hash: str, previous_hash: Optional[str],
+                   headers) -> Dict[str, Any]:
+    """Outcome of an export that was written (or found identical to the previous file)"""
+    return {'changed': content_hash != previous_hash,
+            'samples': samples_count,
+            'plan': validator.summary(),
+            'warnings': validator.warnings,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_hash': content_hash}
+
+async def login_async(username: str, password: str, session) -> str:
+    with metrics.timer('login'):
+        async with session.post(f"{metadata_server}/auth/login",
+                                json={"username": username, "password": password}) as r:
+            r.raise_for_status()
+            token = (await r.json())["token"]
+    print("Token JWT ottenuto:", token)
+    return token
+
+async def call_protected_async(token: str, vid: str, json_path: str, session,
+                               cached: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Same as call_protected, streaming the export through an aiohttp session"""
+    with metrics.timer('call_protected'):
+        async with session.get(f"{metadata_server}/fandango/export/json/PID{vid}",
+                               headers=_conditional_headers(token, cached)) as r:
+            r.raise_for_status()
+            if r.status == 304:
+                return _not_modified()
+            previous_hash = cached['content_hash'] if cached else None
+            validator = SampleValidator()
+            samples_count, content_hash = await write_samples_async(
+                json_path, validator.validate_async(iter_export_samples_async(r.content)), previous_hash)
+            return _export_result(validator, samples_count, content_hash, previous_hash, r.headers)
 
 def decode(token: str):
     decoded = jwt.decode(token, api_decode,
@@ -81,6 +347,21 @@ def decode(token: str):
     return decoded
 
 def perform_action(args):
-    success, info = generate_experiment_metadata(args['name'], args['vid'])
+    try:
+        vids = parse_vids(args.get('vid'), args.get('vid_file'))
+    except (OSError, ValueError) as e:
+        return {'success': False, 'info': f"could not read the visit ids: {e}"}
+    if not vids:
+        return {'success': False, 'info': 'no visit id given, use --vid or --vid_file'}
+    if len(vids) == 1:
+        success, info = generate_experiment_metadata(args['name'], vids[0], not args.get('force'),
+                                                     args.get('metrics_out'),
+                                                     args.get('format') or DEFAULT_METADATA_FORMAT)
+    else:
+        success, info = generate_batch_experiment_metadata(args['name'], vids,
+                                                           int(args.get('parallel') or DEFAULT_EXPORT_PARALLELISM),
+                                                           not args.get('force'), args.get('metrics_out'),
+                                                           args.get('format') or DEFAULT_METADATA_FORMAT,
+                                                           bool(args.get('use_async')))
     results = {'success': success, 'info': info}
     return results
\ No newline at end of file
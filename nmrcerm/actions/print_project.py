@@ -1,16 +1,23 @@
-from nmrcerm.db.sqlite_db import get_project_info
+from nmrcerm.db.sqlite_db import get_project_info, get_bucket_id, get_upload_runs, get_upload_summary, \
+    get_upload_results
 from tabulate import tabulate
 
-def print_project(project_name):
+def print_project(project_name, summary=False, results=False, node_type=None, status=None, run_id=None, limit=None):
     """
     Function that prints info for a FandanGO project
 
     Args:
         project_name (str): FandanGO project name
+        summary (bool): also print the last bucket, the upload runs and the node counts per type and status
+        results (bool): also print the uploaded nodes with their ARIA record/field ids
+        node_type (str): only list nodes of this type (sample, dataset or experiment)
+        status (str): only list nodes with this status (created, updated or failed)
+        run_id (int): upload run to summarise/list, by default the last one for the summary and all for the list
+        limit (int): maximum number of runs/nodes listed
 
     Returns:
         success (bool): if everything went ok or not
-        info (list): project related rows
+        info (list): project related rows, or a dict with them and the requested upload history
     """
 
     print('FandanGO project info:\n')
@@ -20,14 +27,62 @@ def print_project(project_name):
     try:
         column_names, project_info = get_project_info(project_name)
         print(tabulate(project_info, headers=column_names, tablefmt="pretty"))
-        success = True
         info = project_info
+
+        if summary or results or node_type or status:
+            info = {'project_info': project_info}
+        if summary:
+            info['summary'] = print_upload_summary(project_name, run_id, limit)
+        if results or node_type or status:
+            column_names, rows = get_upload_results(project_name, run_id, node_type, status, limit)
+            print(f'\nUploaded nodes ({len(rows)}):\n')
+            print(tabulate(rows, headers=column_names, tablefmt="pretty"))
+            info['results'] = [dict(zip(column_names, row)) for row in rows]
+        success = True
     except Exception as e:
         info = e
     return success, info
 
 
+def print_upload_summary(project_name, run_id=None, limit=None):
+    """
+    Function that prints the upload runs of a project and the node counts of one of them
+
+    Returns:
+        dict: last bucket, runs and counts per node type and status
+    """
+
+    bucket_id = get_bucket_id(project_name)
+    print(f'\nLast bucket: {bucket_id or "-"}')
+
+    column_names, runs = get_upload_runs(project_name, limit)
+    print(f'\nUpload runs ({len(runs)}):\n')
+    print(tabulate(runs, headers=column_names, tablefmt="pretty"))
+
+    run_id, counts = get_upload_summary(project_name, run_id)
+    totals = {}
+    for node_type, node_status, count in counts:
+        totals.setdefault(node_type, {})[node_status] = count
+    statuses = sorted({node_status for _, node_status, _ in counts})
+    print(f'\nNodes of run {run_id if run_id is not None else "-"}:\n')
+    print(tabulate([[node_type] + [by_status.get(s, 0) for s in statuses] + [sum(by_status.values())]
+                    for node_type, by_status in totals.items()],
+                   headers=['node_type'] + statuses + ['total'], tablefmt="pretty"))
+
+    return {'bucket_id': bucket_id,
+            'runs': [dict(zip(column_names, run)) for run in runs],
+            'run_id': run_id,
+            'nodes': totals,
+            'failures': sum(by_status.get('failed', 0) for by_status in totals.values())}
+
+
 def perform_action(args):
-    success, info = print_project(args['name'])
+    success, info = print_project(args['name'],
+                                  bool(args.get('summary')),
+                                  bool(args.get('results')),
+                                  args.get('type'),
+                                  args.get('status'),
+                                  int(args['run']) if args.get('run') else None,
+                                  int(args['limit']) if args.get('limit') else None)
     results = {'success': success, 'info': info}
     return results
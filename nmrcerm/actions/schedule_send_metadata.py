@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+from nmrcerm.actions.send_metadata import send_metadata
+from nmrcerm.constants import DEFAULT_SCHEDULER_PARALLELISM, DEFAULT_HOST_CONCURRENCY, DEFAULT_UPLOAD_WORKERS, \
+    DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, DEFAULT_BATCH_SIZE, DEFAULT_CIRCUIT_MODE, CIRCUIT_OFF, \
+    CIRCUIT_FAILURE_RATE, DEFAULT_MAX_FIELD_BYTES, DEFAULT_OVERSIZED_PAYLOAD
+from nmrcerm.db.sqlite_db import get_pending_upload_projects
+from nmrcerm.utils.metrics import metrics
+from nmrcerm.utils.rate_limiter import HostConcurrencyLimiter
+from nmrcerm.utils.circuit_breaker import CircuitBreaker
+
+
+def schedule_send_metadata(project_names: List[str], parallel: int = DEFAULT_SCHEDULER_PARALLELISM,
+                           max_requests: int = DEFAULT_HOST_CONCURRENCY, workers: int = DEFAULT_UPLOAD_WORKERS,
+                           rate: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_RATE_BURST, resume: bool = False,
+                           delta: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                           metrics_out: str = None, circuit: str = DEFAULT_CIRCUIT_MODE,
+                           failure_rate: float = CIRCUIT_FAILURE_RATE, max_field_size: int = DEFAULT_MAX_FIELD_BYTES,
+                           oversized: str = DEFAULT_OVERSIZED_PAYLOAD) -> Dict[str, Any]:
+    """
+    Function that runs send-metadata for several FandanGO projects at the same time. A slow
+    or failing project only holds its own pool slot, and the number of ARIA requests in
+    flight is capped per host across all of them. All projects share one circuit breaker,
+    so an unavailable ARIA backend stops (or pauses) the whole run instead of every
+    project retrying on its own.
+
+    Args:
+        project_names (list): FandanGO projects to upload
+        parallel (int): maximum number of projects uploaded at the same time
+        max_requests (int): maximum number of concurrent requests to each ARIA host, over all projects
+        workers (int): maximum number of concurrent ARIA pushes of each project
+        rate (float): initial ARIA requests per second of each project
+        burst (int): maximum number of ARIA requests sent back to back by each project
+        resume (bool): reuse the last bucket of each project and skip the nodes already uploaded to it
+        delta (bool): only push the nodes that are new or changed since the last upload of each project
+        batch_size (int): maximum number of sibling Records or Fields sent in one ARIA request
+        metrics_out (str): file where the latency/throughput summary of the whole run is written
+        circuit (str): circuit breaker mode (fail-fast, pause or off), see send_metadata
+        failure_rate (float): fraction of failed ARIA requests that opens the circuit
+        max_field_size (int): largest JSON Field content, in bytes, pushed as it is
+        oversized (str): what to do with larger ones (split or externalise), see send_metadata
+
+    Returns:
+        success (bool): if every project was uploaded without failures
+        info (dict): per project status, and the metrics of the run
+    """
+
+    info = {'projects': {}}
+    if not project_names:
+        print('No projects to upload')
+        return True, info
+
+    slots = HostConcurrencyLimiter(max_requests)
+    breaker = CircuitBreaker(circuit, failure_rate) if circuit != CIRCUIT_OFF else None
+    parallel = max(1, min(int(parallel), len(project_names)))
+    print(f"Uploading {len(project_names)} projects, {parallel} at a time, "
+          f"at most {slots.max_concurrent} concurrent ARIA requests")
+
+    def upload(project_name):
+        start = time.monotonic()
+        try:
+            success, project_info = send_metadata(project_name, workers, rate, burst, resume, delta, batch_size,
+                                                  slots=slots, circuit=circuit, breaker=breaker,
+                                                  max_field_size=max_field_size, oversized=oversized)
+        except Exception as e:
+            success, project_info = False, str(e)
+        return success, project_info, time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(upload, project_name): project_name for project_name in project_names}
+        for done, future in enumerate(as_completed(futures), start=1):
+            project_name = futures[future]
+            success, project_info, elapsed = future.result()
+            status = project_status(success, project_info, elapsed)
+            info['projects'][project_name] = status
+            metrics.increment('projects_uploaded' if status['success'] else 'projects_failed')
+            if status['success']:
+                print(f"✓ [{done}/{len(project_names)}] {project_name}: {status['records_created']} records, "
+                      f"{status['fields_created']} fields in {elapsed:.1f}s")
+            else:
+                print(f"✗ [{done}/{len(project_names)}] {project_name}: "
+                      f"{status.get('error') or str(status['failed_operations']) + ' failed operations'}")
+
+    success = all(status['success'] for status in info['projects'].values())
+    info['circuit_opened'] = breaker.times_opened if breaker else 0
+    info['metrics'] = metrics.summary()
+    if metrics_out:
+        metrics.write(metrics_out)
+    return success, info
+
+
+def project_status(success: bool, project_info: Any, elapsed: float) -> Dict[str, Any]:
+    """
+    Function that reduces the result of send_metadata to the counts reported by the scheduler
+    """
+
+    if not isinstance(project_info, dict):
+        return {'success': False, 'error': str(project_info), 'elapsed_s': round(elapsed, 3)}
+    return {'success': success and not project_info['failed_operations'],
+            'bucket_id': project_info['bucket'].get('id'),
+            'run_id': project_info['run_id'],
+            'records_created': project_info['records_created'],
+            'fields_created': project_info['fields_created'],
+            'nodes_skipped': project_info['nodes_skipped'],
+            'failed_operations': len(project_info['failed_operations']),
+            'elapsed_s': round(elapsed, 3)}
+
+
+def perform_action(args):
+    if args.get('projects'):
+        project_names = list(dict.fromkeys(p.strip() for p in args['projects'].split(',') if p.strip()))
+    else:
+        project_names = get_pending_upload_projects()
+    success, info = schedule_send_metadata(project_names,
+                                           int(args.get('parallel') or DEFAULT_SCHEDULER_PARALLELISM),
+                                           int(args.get('max_requests') or DEFAULT_HOST_CONCURRENCY),
+                                           int(args.get('workers') or DEFAULT_UPLOAD_WORKERS),
+                                           float(args.get('rate') or DEFAULT_RATE_LIMIT),
+                                           int(args.get('burst') or DEFAULT_RATE_BURST),
+                                           bool(args.get('resume')),
+                                           bool(args.get('delta')),
+                                           int(args.get('batch_size') or DEFAULT_BATCH_SIZE),
+                                           args.get('metrics_out'),
+                                           args.get('circuit') or DEFAULT_CIRCUIT_MODE,
+                                           float(args.get('failure_rate') or CIRCUIT_FAILURE_RATE),
+                                           int(args.get('max_field_size') or DEFAULT_MAX_FIELD_BYTES),
+                                           args.get('oversized') or DEFAULT_OVERSIZED_PAYLOAD)
+    results = {'success': success, 'info': info}
+    return results
@@ -1,13 +1,31 @@
-from nmrcerm.db.sqlite_db import get_visit_id, get_metadata_path
+from nmrcerm.db.sqlite_db import get_visit_id, get_metadata_path, get_bucket_id, update_project, save_upload_run
+from nmrcerm.constants import DEFAULT_UPLOAD_WORKERS, DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, DEFAULT_BATCH_SIZE, \
+    DEFAULT_CIRCUIT_MODE, CIRCUIT_OFF, CIRCUIT_FAILURE_RATE, RETRY_JITTER, DEFAULT_MAX_FIELD_BYTES, \
+    DEFAULT_OVERSIZED_PAYLOAD
+from nmrcerm.utils.upload_engine import UploadEngine, AsyncUploadEngine, build_upload_tree, plan_payloads
+from nmrcerm.utils.rate_limiter import AdaptiveRateLimiter
+from nmrcerm.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from nmrcerm.utils.batching import PushBatcher, AsyncPushBatcher, RECORD_OPERATION, FIELD_OPERATION, \
+    build_batch_mutation, record_input, field_input
+from nmrcerm.utils.samples_io import iter_samples
+from nmrcerm.utils.validation import SampleValidator
+from nmrcerm.utils.payload_planner import PayloadPlanner
+from nmrcerm.utils.metrics import metrics
+from nmrcerm.utils.checkpoint import UploadCheckpoint, NODE_NEW, NODE_CHANGED, NODE_UNCHANGED
+from nmrcerm.utils.config import load_config, get_setting
+from nmrcerm.utils.async_http import create_async_session
 from datetime import datetime
-from dotenv import load_dotenv
-import json
-from fGOaria import AriaClient, Bucket, Field, Record
-import uuid
+from fGOaria import AriaClient, Bucket, Field
+import asyncio
+import os
+import random
+import requests
 import time
-from functools import wraps
+from contextlib import contextmanager
+from functools import partial, wraps
 
-load_dotenv()
+# fGOaria reads its settings from the environment
+load_config()
 
 def retry_on_error(max_retries=3, delay=1, backoff=1.5):
     """
@@ -17,54 +35,247 @@ def retry_on_error(max_retries=3, delay=1, backoff=1.5):
         max_retries: Maximum number of retry attempts
         delay: Initial delay between retries (seconds)
         backoff: Multiplier for delay on each retry
+
+    If the wrapped call gets a `limiter` keyword argument, every attempt is reported to
+    it so the shared rate adapts to the failures. With a `breaker` keyword argument, each
+    attempt first asks the shared circuit breaker, and a CircuitOpenError is raised at once
+    instead of being retried. Delays are jittered so concurrent retries do not line up.
+    Calls, attempts, failures and retry sleeps are recorded in the metrics registry under
+    the function name.
     """
     def decorator(func):
+        name = func.__name__
+
         @wraps(func)
+        @metrics.timed(name)
         def wrapper(*args, **kwargs):
+            limiter = kwargs.get('limiter')
+            breaker = kwargs.get('breaker')
             current_delay = delay
             for attempt in range(max_retries):
                 try:
-                    result = func(*args, **kwargs)
-                    if attempt > 0:
-                        print(f"✓ Success on attempt {attempt + 1}")
-                    return result
+                    if breaker:
+                        breaker.before_call()
+                    with metrics.timer(f"{name}.attempt"):
+                        result = func(*args, **kwargs)
                 except Exception as e:
-                    if attempt == max_retries - 1:
-                        print(f"✗ Final attempt {attempt + 1} failed: {e}")
-                        raise e
-                    print(f"✗ Attempt {attempt + 1} failed: {e}")
-                    print(f"  Retrying in {current_delay:.1f}s...")
-                    time.sleep(current_delay)
+                    sleep = attempt_failed(name, e, attempt, max_retries, current_delay, limiter, breaker)
+                    with metrics.timer('retry_sleep'):
+                        time.sleep(sleep)
                     current_delay *= backoff
+                    continue
+                attempt_succeeded(attempt, limiter, breaker)
+                return result
             return None
         return wrapper
     return decorator
 
+def attempt_succeeded(attempt, limiter=None, breaker=None):
+    """Reports a successful attempt of a retried call to the shared rate limiter and circuit breaker"""
+    if limiter:
+        limiter.on_success()
+    if breaker:
+        breaker.on_success()
+    if attempt > 0:
+        print(f"✓ Success on attempt {attempt + 1}")
+
+def attempt_failed(name, error, attempt, max_retries, delay, limiter=None, breaker=None):
+    """
+    Reports a failed attempt of a retried call to the metrics, the rate limiter and the circuit breaker
+
+    Returns:
+        float: jittered seconds to wait before the next attempt
+
+    Raises:
+        Exception: the error itself if the circuit is open or it was the last attempt
+    """
+    if isinstance(error, CircuitOpenError):
+        metrics.increment(f"{name}.short_circuited")
+        raise error
+    metrics.increment(f"{name}.failures")
+    if limiter:
+        limiter.on_failure(error)
+    if breaker:
+        breaker.on_failure(error)
+    if attempt == max_retries - 1:
+        print(f"✗ Final attempt {attempt + 1} failed: {error}")
+        raise error
+    sleep = jittered(delay)
+    print(f"✗ Attempt {attempt + 1} failed: {error}")
+    print(f"  Retrying in {sleep:.1f}s...")
+    metrics.increment(f"{name}.retries")
+    return sleep
+
+def jittered(delay):
+    return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+
+@contextmanager
+def aria_request(visit, limiter=None, slots=None):
+    """Waits for the rate limiter and, if given, holds a slot of the ARIA host while the request runs"""
+    if limiter:
+        metrics.observe('rate_limit_wait', limiter.acquire())
+    if slots is None:
+        yield
+        return
+    with slots.slot(getattr(getattr(visit, 'client', None), 'base_url', None)) as waited:
+        metrics.observe('host_slot_wait', waited)
+        yield
+
 @retry_on_error(max_retries=3, delay=1, backoff=2)
-def push_record_safe(visit, record):
+def push_record_safe(visit, record, limiter=None, slots=None, breaker=None):
     """Safely push a record with retry logic"""
-    return visit.push(record)
+    with aria_request(visit, limiter, slots):
+        return visit.push(record)
 
 @retry_on_error(max_retries=5, delay=2, backoff=1.5)
-def push_field_safe(visit, field):
+def push_field_safe(visit, field, limiter=None, slots=None, breaker=None):
     """Safely push a field with retry logic and longer delays"""
-    return visit.push(field)
+    # fGOaria replaces the content of the Field it pushes by its JSON encoding: each attempt pushes a fresh
+    # copy, so a retry does not send the encoded string again
+    pushed = Field(field.record_id, field.field_type, field.content, field.options, description=field.description)
+    with aria_request(visit, limiter, slots):
+        visit.push(pushed)
+    field.id = pushed.id
+    getattr(visit, 'fields', {})[field.id] = field
+    return field
+
+@retry_on_error(max_retries=3, delay=1, backoff=2)
+def push_batch_safe(visit, query, variables, limiter=None, slots=None, breaker=None):
+    """Safely send a multi-operation GraphQL request with retry logic"""
+    with aria_request(visit, limiter, slots):
+        response = requests.post(visit.client.base_url, json={'query': query, 'variables': variables},
+                                 headers=visit.client.headers)
+    response.raise_for_status()
+    return response.json()
 
-def send_metadata(project_name):
+@retry_on_error(max_retries=3, delay=1, backoff=2)
+def create_bucket_safe(visit, embargo_date, slots=None, breaker=None):
+    """Safely create the visit's bucket with retry logic"""
+    with aria_request(visit, slots=slots):
+        return visit.create_bucket(embargo_date)
+
+def async_retry_on_error(max_retries=3, delay=1, backoff=1.5):
+    """
+    Same as retry_on_error for coroutines: the delay between attempts is awaited, so the
+    other pushes of the event loop keep going while one of them backs off
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            limiter = kwargs.get('limiter')
+            breaker = kwargs.get('breaker')
+            current_delay = delay
+            with metrics.timer(name):
+                for attempt in range(max_retries):
+                    try:
+                        if breaker:
+                            await breaker.before_call_async()
+                        with metrics.timer(f"{name}.attempt"):
+                            result = await func(*args, **kwargs)
+                    except Exception as e:
+                        sleep = attempt_failed(name, e, attempt, max_retries, current_delay, limiter, breaker)
+                        with metrics.timer('retry_sleep'):
+                            await asyncio.sleep(sleep)
+                        current_delay *= backoff
+                        continue
+                    attempt_succeeded(attempt, limiter, breaker)
+                    return result
+            return None
+        return wrapper
+    return decorator
+
+async def post_graphql_async(visit, session, query, variables, limiter=None):
+    """Sends a GraphQL document to the data manager's ARIA endpoint through the aiohttp session"""
+    if limiter:
+        metrics.observe('rate_limit_wait', await limiter.acquire_async())
+    async with session.post(visit.client.base_url, json={'query': query, 'variables': variables},
+                            headers=visit.client.headers) as response:
+        response.raise_for_status()
+        return await response.json()
+
+async def push_entity_async(visit, session, entity, operation, to_input, registry, limiter=None):
+    response = await post_graphql_async(visit, session, build_batch_mutation(*operation, 1), {'i0': to_input(entity)},
+                                        limiter)
+    item = (response.get('data') or {}).get('o0')
+    if not item:
+        raise Exception(response.get('errors') or f'{operation[0]} returned no data')
+    entity.populate(item)
+    getattr(visit, registry, {})[entity.id] = entity
+    return entity
+
+@async_retry_on_error(max_retries=3, delay=1, backoff=2)
+async def push_record_async(visit, record, limiter=None, session=None, breaker=None):
+    """Push a record without blocking the event loop, with retry logic"""
+    return await push_entity_async(visit, session, record, RECORD_OPERATION, record_input, 'records', limiter)
+
+@async_retry_on_error(max_retries=5, delay=2, backoff=1.5)
+async def push_field_async(visit, field, limiter=None, session=None, breaker=None):
+    """Push a field without blocking the event loop, with retry logic and longer delays"""
+    return await push_entity_async(visit, session, field, FIELD_OPERATION, field_input, 'fields', limiter)
+
+@async_retry_on_error(max_retries=3, delay=1, backoff=2)
+async def push_batch_async(visit, query, variables, limiter=None, session=None, breaker=None):
+    """Send a multi-operation GraphQL request without blocking the event loop, with retry logic"""
+    return await post_graphql_async(visit, session, query, variables, limiter)
+
+async def upload_async(visit, bucket_id, nodes, limiter, workers=DEFAULT_UPLOAD_WORKERS, checkpoint=None,
+                       batch_size=DEFAULT_BATCH_SIZE, breaker=None, planned=None, planner=None):
+    """
+    Uploads the nodes with one aiohttp session, whose pool keeps up to workers connections
+    to ARIA open, and an AsyncUploadEngine
+
+    Returns:
+        AsyncUploadEngine: engine, with the created records/fields, failures and statuses
+    """
+    async with create_async_session(workers) as session:
+        batcher = AsyncPushBatcher(visit, partial(push_record_async, session=session, breaker=breaker),
+                                   partial(push_field_async, session=session, breaker=breaker),
+                                   partial(push_batch_async, session=session, breaker=breaker)
+                                   if batch_size > 1 else None, limiter)
+        engine = AsyncUploadEngine(bucket_id, batcher, workers, checkpoint, batch_size, planned, planner)
+        await engine.run(nodes)
+    return engine
+
+def send_metadata(project_name, workers=DEFAULT_UPLOAD_WORKERS, rate=DEFAULT_RATE_LIMIT, burst=DEFAULT_RATE_BURST,
+                  resume=False, delta=False, batch_size=DEFAULT_BATCH_SIZE, metrics_out=None, slots=None,
+                  use_async=False, circuit=DEFAULT_CIRCUIT_MODE, failure_rate=CIRCUIT_FAILURE_RATE, breaker=None,
+                  max_field_size=DEFAULT_MAX_FIELD_BYTES, oversized=DEFAULT_OVERSIZED_PAYLOAD):
     """
     Function that sends FandanGO project info to ARIA with robust error handling
 
     Args:
         project_name (str): FandanGO project name
+        workers (int): maximum number of concurrent ARIA pushes
+        rate (float): initial ARIA requests per second, adapted during the upload
+        burst (int): maximum number of ARIA requests sent back to back
+        resume (bool): reuse the last bucket and skip the nodes already uploaded to it
+        delta (bool): compare the export with the last synced state and only push new or changed nodes
+        batch_size (int): maximum number of sibling Records or Fields sent in one ARIA request
+        metrics_out (str): file where the latency/throughput summary is written (.prom for Prometheus text)
+        slots (HostConcurrencyLimiter): cap on concurrent ARIA requests shared with other uploads
+        use_async (bool): push from an asyncio event loop (needs aiohttp) instead of worker threads;
+            workers is then the number of concurrent pushes and of pooled connections
+        circuit (str): what to do once failure_rate of the recent ARIA requests failed: fail-fast skips
+            the remaining pushes, pause waits for the backend to come back, off keeps retrying every push
+        failure_rate (float): fraction of failed ARIA requests that opens the circuit
+        breaker (CircuitBreaker): circuit breaker shared with other uploads, instead of circuit/failure_rate
+        max_field_size (int): largest JSON Field content, in bytes, pushed as it is
+        oversized (str): what to do with larger ones: split them into several Fields of the same Record (a
+            value that does not fit in one fails the node), or externalise their largest values to sidecar files
+            under the metadata OUTPUT_PATH, reported in the info warnings
 
     Returns:
         success (bool): if everything went ok or not
-        info (dict): bucket, record and field ARIA data
+        info (dict): bucket, upload run id (see print-project --summary), upload plan (nodes, and the exact
+            Records and Fields of an upload from scratch), record and field ARIA ids,
+            values left out of ARIA in sidecar files
+            or, if the export is malformed or has payloads that cannot be pushed, the validation errors
     """
 
     success = True
     info = None
-    failed_operations = []
 
     try:
         visit_id = get_visit_id(project_name)
@@ -72,162 +283,68 @@ def send_metadata(project_name):
         metadata_path = get_metadata_path(project_name)
         print(f"metadata_path:{metadata_path}")
 
+        output_path = get_setting('METADATA', 'OUTPUT_PATH') or os.path.dirname(metadata_path)
+        planner = PayloadPlanner(max_field_size, oversized,
+                                 os.path.join(output_path, f"project_{project_name}_sidecars"))
+
+        # pre-flight: a malformed export, or a payload that cannot be pushed, fails here before a bucket is created
+        validator = SampleValidator()
+        with metrics.timer('validate_samples'):
+            fields_plan = plan_payloads(build_upload_tree(validator.validate(iter_samples(metadata_path))), planner)
+        plan = dict(validator.summary(), **fields_plan)
+        for warning in validator.warnings:
+            print(f"⚠ {warning}")
+        print(f"Upload plan: {plan['samples']} samples, {plan['datasets']} datasets, "
+              f"{plan['experiments']} experiments ({plan['records']} records, {plan['fields']} fields)")
+        if plan['duplicates_removed']:
+            print(f"↷ Repeated entries dropped: {plan['duplicates_removed']}")
+
         aria = AriaClient(True)
-        aria.login()
+        with metrics.timer('aria_login'):
+            aria.login()
+
+        if breaker is None and circuit != CIRCUIT_OFF:
+            breaker = CircuitBreaker(circuit, failure_rate)
 
         today = datetime.today()
         visit = aria.new_data_manager(int(visit_id), 'visit', False)
         embargo_date = datetime(today.year + 3, today.month, today.day).strftime('%Y-%m-%d')
-        bucket = visit.create_bucket(embargo_date)
-        print(f"Bucket ID: {bucket.id}")
+        bucket_id = get_bucket_id(project_name) if resume or delta else None
+        if bucket_id:
+            bucket = Bucket(int(visit_id), 'visit', embargo_date, id=bucket_id)
+            print(f"{'Syncing changes' if delta else 'Resuming upload'} into bucket ID: {bucket.id}")
+        else:
+            with metrics.timer('create_bucket'):
+                bucket = create_bucket_safe(visit, embargo_date, slots=slots, breaker=breaker)
+            update_project(project_name, 'bucket_id', bucket.id)
+            print(f"Bucket ID: {bucket.id}")
+        checkpoint = UploadCheckpoint(project_name, bucket.id, resume=bool(bucket_id))
 
-        # experiment metadata
-        with open(metadata_path, 'r') as file:
-            samples_data = json.load(file)
+        # experiment metadata, read one sample at a time and normalised as in the pre-flight pass
+        samples_data = SampleValidator().validate(iter_samples(metadata_path))
 
-        created_records = []
-        created_fields = []
-        
-        print(f"Processing {len(samples_data)} samples...")
+        print(f"Processing samples with {workers} workers...")
 
-        for sample_idx, sample in enumerate(samples_data):
-            sample_name = sample['name']
-            sample_uuid = str(uuid.uuid4())
-            
-            print(f"\n[{sample_idx + 1}/{len(samples_data)}] Processing sample: {sample_name}")
-            
+        limiter = AdaptiveRateLimiter(rate, burst)
+        started_at = datetime.now().isoformat()
+        if use_async:
+            engine = asyncio.run(upload_async(visit, bucket.id, build_upload_tree(samples_data, checkpoint), limiter,
+                                              workers, checkpoint, batch_size, breaker, plan['nodes'], planner))
+            created_records, created_fields, failed_operations = \
+                engine.created_records, engine.created_fields, engine.failed_operations
+        else:
+            batcher = PushBatcher(visit, partial(push_record_safe, breaker=breaker),
+                                  partial(push_field_safe, breaker=breaker),
+                                  partial(push_batch_safe, breaker=breaker) if batch_size > 1 else None,
+                                  limiter, workers, slots)
+            engine = UploadEngine(bucket.id, batcher, workers, checkpoint, batch_size, plan['nodes'], planner)
             try:
-                # Create sample record
-                sample_record = Record(bucket.id, 'Generic', f"{sample_name}: {sample_uuid}")
-                push_record_safe(visit, sample_record)
-                print(f"✓ Sample record created: {sample_record.id}")
-                
-                sample_data = {k: v for k, v in sample.items() if k != 'experimentDTO'}
-                
-                # Create field for sample data
-                sample_field = Field(sample_record.id, 'JSON', sample_data)
-                print('  Pushing sample field...')
-                
-                push_field_safe(visit, sample_field)
-                print(f"✓ Sample field created: {getattr(sample_field, 'id', 'unknown')}")
-                
-                # Rate limiting
-                time.sleep(0.5)
-                
-                if not isinstance(sample_field, Field):
-                    failed_operations.append(f"Sample field creation failed for {sample_name}")
-                    continue
-                    
-                created_records.append({
-                    'type': 'sample',
-                    'name': sample_name,
-                    'uuid': sample_uuid,
-                    'record_id': sample_record.id
-                })
-                
-                created_fields.append({
-                    'record_id': sample_record.id,
-                    'field_id': getattr(sample_field, 'id', 'unknown'),
-                    'field_type': 'JSON',
-                    'description': f'Sample data for {sample_name}',
-                    'data': sample_data,
-                    'field_metadata': sample_field.__dict__ if hasattr(sample_field, '__dict__') else {},
-                    'field_object': sample_field
-                })
-
-                if 'experimentDTO' in sample and sample['experimentDTO']:
-                    print(f"  Processing {len(sample['experimentDTO'])} datasets...")
-                    
-                    for dataset_idx, experiment_dto in enumerate(sample['experimentDTO']):
-                        dataset_id = experiment_dto['id']
-                        print(f"    [{dataset_idx + 1}] Processing dataset: {dataset_id}")
-                        
-                        try:
-                            dataset_record = Record(bucket.id, 'Generic', f"dataset_{dataset_id}_experiment_{sample_uuid}")
-                            push_record_safe(visit, dataset_record)
-                            print(f"    ✓ Dataset record created: {dataset_record.id}")
-                            
-                            dataset_field = Field(dataset_record.id, 'JSON', experiment_dto, description=f"{sample_name}_Dataset_{dataset_id}")
-                            print(f"      Pushing dataset field...")
-                            
-                            push_field_safe(visit, dataset_field)
-                            print(f"    ✓ Dataset field created: {getattr(dataset_field, 'id', 'unknown')}")
-                            
-                            time.sleep(0.5)
-
-                            if not isinstance(dataset_field, Field):
-                                failed_operations.append(f"Dataset field creation failed for {dataset_id}")
-                                continue
-                                
-                            created_records.append({
-                                'type': 'dataset',
-                                'dataset_id': dataset_id,
-                                'parent_uuid': sample_uuid,
-                                'record_id': dataset_record.id
-                            })
-                            
-                            created_fields.append({
-                                'record_id': dataset_record.id,
-                                'field_id': getattr(dataset_field, 'id', 'unknown'),
-                                'field_type': 'JSON',
-                                'description': f"{sample_name}_Dataset_{dataset_id}",
-                                'data': experiment_dto,
-                                'field_metadata': dataset_field.__dict__ if hasattr(dataset_field, '__dict__') else {},
-                                'field_object': dataset_field
-                            })
-
-                            if 'experimentList' in experiment_dto and experiment_dto['experimentList']:
-                                print(f"      Processing {len(experiment_dto['experimentList'])} experiments...")
-                                
-                                for exp_idx, experiment in enumerate(experiment_dto['experimentList']):
-                                    expno = experiment['expno']
-                                    print(f"        [{exp_idx + 1}] Processing experiment: {expno}")
-                                    
-                                    try:
-                                        experiment_record = Record(bucket.id, 'Generic', f"experiment_{expno}_dataset_{dataset_id}")
-                                        push_record_safe(visit, experiment_record)
-                                        print(f"        ✓ Experiment record created: {experiment_record.id}")
-                                        
-                                        experiment_field = Field(experiment_record.id, 'JSON', experiment)
-                                        print(f"          Pushing experiment field...")
-                                        
-                                        push_field_safe(visit, experiment_field)
-                                        print(f"        ✓ Experiment field created: {getattr(experiment_field, 'id', 'unknown')}")
-                                        
-                                        time.sleep(0.3)
-                                        
-                                        if not isinstance(experiment_field, Field):
-                                            failed_operations.append(f"Experiment field creation failed for {expno} in dataset {dataset_id}")
-                                            continue
-                                            
-                                        created_records.append({
-                                            'type': 'experiment',
-                                            'expno': expno,
-                                            'dataset_id': dataset_id,
-                                            'record_id': experiment_record.id
-                                        })
-                                        
-                                        created_fields.append({
-                                            'record_id': experiment_record.id,
-                                            'field_id': getattr(experiment_field, 'id', 'unknown'),
-                                            'field_type': 'JSON',
-                                            'description': f'Experiment {expno} data',
-                                            'data': experiment,
-                                            'field_metadata': experiment_field.__dict__ if hasattr(experiment_field, '__dict__') else {},
-                                            'field_object': experiment_field
-                                        })
-                                        
-                                    except Exception as e:
-                                        failed_operations.append(f"Experiment {expno} in dataset {dataset_id}: {str(e)}")
-                                        print(f"        ✗ Failed to process experiment {expno}: {e}")
-                                        
-                        except Exception as e:
-                            failed_operations.append(f"Dataset {dataset_id}: {str(e)}")
-                            print(f"    ✗ Failed to process dataset {dataset_id}: {e}")
-                            
-            except Exception as e:
-                failed_operations.append(f"Sample {sample_name}: {str(e)}")
-                print(f"✗ Failed to process sample {sample_name}: {e}")
+                created_records, created_fields, failed_operations = engine.run(build_upload_tree(samples_data,
+                                                                                                  checkpoint))
+            finally:
+                batcher.close()
+        run_id = save_upload_run(project_name, bucket.id, started_at, engine.results, len(created_records),
+                                 len(created_fields), engine.node_status[NODE_UNCHANGED])
 
         # Summary
         print(f"\n{'='*60}")
@@ -235,6 +352,12 @@ def send_metadata(project_name):
         print(f"{'='*60}")
         print(f"✓ Records created: {len(created_records)}")
         print(f"✓ Fields created: {len(created_fields)}")
+        if engine.node_status[NODE_UNCHANGED]:
+            print(f"↷ Already uploaded: {engine.node_status[NODE_UNCHANGED]}")
+        removed_nodes = checkpoint.removed_keys() if bucket_id else []
+        if delta:
+            print(f"Δ New: {engine.node_status[NODE_NEW]}, changed: {engine.node_status[NODE_CHANGED]}, "
+                  f"unchanged: {engine.node_status[NODE_UNCHANGED]}, no longer exported: {len(removed_nodes)}")
         
         if failed_operations:
             print(f"✗ Failed operations: {len(failed_operations)}")
@@ -242,15 +365,35 @@ def send_metadata(project_name):
                 print(f"  - {failure}")
         else:
             print("✓ All operations completed successfully!")
+        if breaker and breaker.times_opened:
+            print(f"⚡ Circuit opened {breaker.times_opened} time(s), state: {breaker.state}")
+        # externalised values are kept in local sidecar files only, ARIA gets a reference to them
+        warnings = [f"{value['node']}: '{value['key']}' ({value['bytes']} bytes) is not in ARIA, it was moved to "
+                    f"{value['path']}" for value in planner.externalised]
+        if warnings:
+            print(f"⚠ Values moved to sidecar files: {len(warnings)}")
+            for warning in warnings:
+                print(f"  - {warning}")
             
         info = {
             'bucket': bucket.__dict__,
+            'run_id': run_id,
             'records_created': len(created_records),
             'fields_created': len(created_fields),
+            'nodes_skipped': engine.node_status[NODE_UNCHANGED],
+            'nodes_status': dict(engine.node_status),
+            'nodes_removed': removed_nodes,
+            'plan': plan,
             'records_detail': created_records,
             'fields_detail': created_fields,
-            'failed_operations': failed_operations
+            'failed_operations': failed_operations,
+            'warnings': warnings,
+            'final_rate': limiter.rate,
+            'circuit_opened': breaker.times_opened if breaker else 0,
+            'metrics': metrics.summary()
         }
+        if metrics_out:
+            metrics.write(metrics_out)
         
     except Exception as e:
         success = False
@@ -260,6 +403,18 @@ def send_metadata(project_name):
     return success, info
 
 def perform_action(args):
-    success, info = send_metadata(args['name'])
+    success, info = send_metadata(args['name'],
+                                  int(args.get('workers') or DEFAULT_UPLOAD_WORKERS),
+                                  float(args.get('rate') or DEFAULT_RATE_LIMIT),
+                                  int(args.get('burst') or DEFAULT_RATE_BURST),
+                                  bool(args.get('resume')),
+                                  bool(args.get('delta')),
+                                  int(args.get('batch_size') or DEFAULT_BATCH_SIZE),
+                                  args.get('metrics_out'),
+                                  use_async=bool(args.get('use_async')),
+                                  circuit=args.get('circuit') or DEFAULT_CIRCUIT_MODE,
+                                  failure_rate=float(args.get('failure_rate') or CIRCUIT_FAILURE_RATE),
+                                  max_field_size=int(args.get('max_field_size') or DEFAULT_MAX_FIELD_BYTES),
+                                  oversized=args.get('oversized') or DEFAULT_OVERSIZED_PAYLOAD)
     results = {'success': success, 'info': info}
     return results
@@ -5,9 +5,69 @@
 ACTION_GENERATE_EXPERIMENT_METADATA = 'generate-experiment-metadata'
 ACTION_SEND_METADATA = 'send-metadata'
 ACTION_PRINT_PROJECT = 'print-project'
+ACTION_SCHEDULE_SEND_METADATA = 'schedule-send-metadata'
 
 #
 # DDBB
 #
 
 DBNAME = 'fandango-nmr-cerm.sqlite'
+DDBB_TIMEOUT = 30
+# idle connections kept open for reuse
+DDBB_POOL_SIZE = 4
+KEEP_PROJECT_HISTORY = True
+
+#
+# ARIA upload
+#
+
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_RATE_LIMIT = 5.0
+DEFAULT_RATE_BURST = 5
+MIN_RATE_LIMIT = 0.5
+MAX_RATE_LIMIT = 20.0
+RATE_LIMIT_INCREASE = 0.1
+RATE_LIMIT_DECREASE = 0.5
+DEFAULT_SCHEDULER_PARALLELISM = 2
+DEFAULT_HOST_CONCURRENCY = 8
+# JSON Field contents larger than this are split into several Fields or moved to sidecar files
+DEFAULT_MAX_FIELD_BYTES = 1024 * 1024
+PAYLOAD_SPLIT = 'split'
+PAYLOAD_EXTERNALISE = 'externalise'
+DEFAULT_OVERSIZED_PAYLOAD = PAYLOAD_SPLIT
+# progress lines printed over an upload, when the number of nodes is known
+UPLOAD_PROGRESS_STEPS = 20
+
+# circuit breaker shared by the ARIA requests of a run
+CIRCUIT_FAIL_FAST = 'fail-fast'
+CIRCUIT_PAUSE = 'pause'
+CIRCUIT_OFF = 'off'
+DEFAULT_CIRCUIT_MODE = CIRCUIT_FAIL_FAST
+CIRCUIT_FAILURE_RATE = 0.5
+CIRCUIT_WINDOW = 20
+CIRCUIT_MIN_CALLS = 10
+CIRCUIT_OPEN_TIMEOUT = 5.0
+CIRCUIT_MAX_OPEN_TIMEOUT = 60.0
+CIRCUIT_PAUSE_TIMEOUT = 300.0
+CIRCUIT_JITTER = 0.2
+RETRY_JITTER = 0.2
+
+#
+# CERM export
+#
+
+DEFAULT_EXPORT_PARALLELISM = 4
+TOKEN_EXPIRY_MARGIN = 60
+
+# storage format of the exported samples -> extension recorded in metadata_path
+METADATA_FORMATS = {
+    'json': '.json',
+    'gzip': '.json.gz',
+    'zstd': '.json.zst',
+    'msgpack': '.msgpack',
+}
+DEFAULT_METADATA_FORMAT = 'json'
+
+# errors and warnings kept (and printed) by the export validation, the rest are only counted
+MAX_VALIDATION_MESSAGES = 20
@@ -1,26 +1,212 @@
+import atexit
 import os
+import threading
+from contextlib import contextmanager
 from sqlite3 import dbapi2 as sqlite
-from nmrcerm.constants import DBNAME
-import configparser
+from nmrcerm.constants import DBNAME, DDBB_TIMEOUT, DDBB_POOL_SIZE
+from nmrcerm.utils.config import get_setting
+
+# idle connections, checked out by transaction() and given back when it ends; at most
+# DDBB_POOL_SIZE are kept open, so short-lived worker threads leave nothing behind
+_idle = []
+_idle_pid = os.getpid()
+_lock = threading.Lock()
+_schema_ready = False
 
-config = configparser.ConfigParser()
-config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'config.yaml'))
-ddbb_path = config['DDBB'].get('DDBB_PATH')
 
 def connect_to_ddbb():
-    connection = sqlite.connect(database=os.path.join(ddbb_path, DBNAME))
-    create_ddbb_data(connection)
+    """
+    Opens a new connection to the plugin database. The schema is created the first time
+    the process connects. Prefer transaction(), which reuses pooled connections.
+    """
+
+    connection = sqlite.connect(database=os.path.join(get_setting('DDBB', 'DDBB_PATH'), DBNAME), timeout=DDBB_TIMEOUT,
+                                check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with _lock:
+        global _schema_ready
+        if not _schema_ready:
+            create_ddbb_data(connection)
+            _schema_ready = True
     return connection
 
 
+def _checkout():
+    global _idle, _idle_pid
+    with _lock:
+        if _idle_pid != os.getpid():
+            # connections inherited from the parent process must not be used (nor closed) here
+            _idle, _idle_pid = [], os.getpid()
+        if _idle:
+            return _idle.pop()
+    return connect_to_ddbb()
+
+
+def _checkin(connection):
+    with _lock:
+        if _idle_pid == os.getpid() and len(_idle) < DDBB_POOL_SIZE:
+            _idle.append(connection)
+            return
+    connection.close()
+
+
+@contextmanager
+def transaction():
+    """
+    Context manager yielding a cursor on a connection checked out of the pool. The changes
+    are committed when the block exits normally and rolled back if it raises, then the
+    connection goes back to the pool.
+    """
+
+    connection = _checkout()
+    try:
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    except Exception:
+        # a connection in an unknown state is not given back
+        connection.close()
+        raise
+    _checkin(connection)
+
+
 def create_ddbb_data(connection):
+    """
+    Brings the database schema up to date. The schema version is kept in PRAGMA user_version
+    and every migration newer than it is applied, in order, inside a write transaction so
+    concurrent processes cannot migrate the same file twice.
+    """
+
     cursor = connection.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _create_base_tables(cursor):
     cursor.execute('''CREATE TABLE IF NOT EXISTS project_info (
                         project_name TEXT NOT NULL,
                         key TEXT NOT NULL,
                         value TEXT NOT NULL);''')
-    connection.commit()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS upload_journal (
+                        project_name TEXT NOT NULL,
+                        bucket_id TEXT NOT NULL,
+                        node_key TEXT NOT NULL,
+                        node_uuid TEXT,
+                        record_id TEXT NOT NULL,
+                        field_id TEXT,
+                        content_hash TEXT NOT NULL,
+                        updated_at TEXT NOT NULL,
+                        PRIMARY KEY (project_name, bucket_id, node_key));''')
 
 
-def close_connection_to_ddbb(connection):
-    connection.close()
+def _key_project_info(cursor):
+    # keep every value written so far as history, then keep only the latest value per key
+    cursor.execute('''CREATE TABLE project_info_history (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        project_name TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        recorded_at TEXT);''')
+    cursor.execute('''INSERT INTO project_info_history (project_name, key, value)
+                      SELECT project_name, key, value FROM project_info ORDER BY rowid;''')
+    cursor.execute('''CREATE TABLE project_info_keyed (
+                        project_name TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        updated_at TEXT,
+                        PRIMARY KEY (project_name, key));''')
+    cursor.execute('''INSERT INTO project_info_keyed (project_name, key, value)
+                      SELECT project_name, key, value FROM project_info
+                      WHERE rowid IN (SELECT MAX(rowid) FROM project_info GROUP BY project_name, key);''')
+    cursor.execute('DROP TABLE project_info')
+    cursor.execute('ALTER TABLE project_info_keyed RENAME TO project_info')
+    cursor.execute('CREATE INDEX idx_project_info_key ON project_info (key)')
+    cursor.execute('CREATE INDEX idx_project_info_history_project ON project_info_history (project_name, key)')
+
+
+def _create_auth_tokens(cursor):
+    cursor.execute('''CREATE TABLE auth_tokens (
+                        base_url TEXT NOT NULL,
+                        username TEXT NOT NULL,
+                        token TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        PRIMARY KEY (base_url, username));''')
+
+
+def _create_export_cache(cursor):
+    cursor.execute('''CREATE TABLE export_cache (
+                        visit_id TEXT PRIMARY KEY,
+                        metadata_path TEXT NOT NULL,
+                        etag TEXT,
+                        last_modified TEXT,
+                        content_hash TEXT NOT NULL,
+                        updated_at TEXT NOT NULL);''')
+
+
+def _create_upload_history(cursor):
+    cursor.execute('''CREATE TABLE upload_runs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        project_name TEXT NOT NULL,
+                        bucket_id TEXT NOT NULL,
+                        started_at TEXT NOT NULL,
+                        finished_at TEXT NOT NULL,
+                        records_created INTEGER NOT NULL,
+                        fields_created INTEGER NOT NULL,
+                        nodes_skipped INTEGER NOT NULL,
+                        failures INTEGER NOT NULL);''')
+    cursor.execute('''CREATE TABLE upload_results (
+                        run_id INTEGER NOT NULL REFERENCES upload_runs (id),
+                        project_name TEXT NOT NULL,
+                        bucket_id TEXT NOT NULL,
+                        node_key TEXT NOT NULL,
+                        node_type TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        record_id TEXT,
+                        field_id TEXT,
+                        error TEXT);''')
+    cursor.execute('CREATE INDEX idx_upload_runs_project ON upload_runs (project_name, id)')
+    cursor.execute('CREATE INDEX idx_upload_results_project ON upload_results (project_name, node_type, status)')
+    cursor.execute('CREATE INDEX idx_upload_results_run ON upload_results (run_id, node_type, status)')
+
+
+MIGRATIONS = [
+    _create_base_tables,
+    _key_project_info,
+    _create_auth_tokens,
+    _create_export_cache,
+    _create_upload_history,
+]
+
+
+@atexit.register
+def close_connections_to_ddbb():
+    """
+    Closes the idle pooled connections
+    """
+
+    global _idle
+    with _lock:
+        connections = _idle if _idle_pid == os.getpid() else []
+        _idle = []
+    for connection in connections:
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -1,62 +1,223 @@
-from nmrcerm.db.sqlite import connect_to_ddbb, close_connection_to_ddbb
+from datetime import datetime
+from nmrcerm.db.sqlite import transaction
+from nmrcerm.constants import KEEP_PROJECT_HISTORY
 
 
-def update_project(project_name, key, value):
-    connection = None
+def update_project(project_name, key, value, keep_history=KEEP_PROJECT_HISTORY):
+    update_project_values(project_name, {key: value}, keep_history)
+
+
+def update_project_values(project_name, values, keep_history=KEEP_PROJECT_HISTORY):
     try:
-        connection = connect_to_ddbb()
-        cursor = connection.cursor()
-        cursor.execute('INSERT INTO project_info VALUES (?, ?, ?)', (project_name, key, value))
-        connection.commit()
-        print(f'... project {project_name} updated: "{key}" = "{value}"')
+        now = datetime.now().isoformat()
+        rows = [(project_name, key, value, now) for key, value in values.items()]
+        with transaction() as cursor:
+            cursor.executemany('INSERT INTO project_info (project_name, key, value, updated_at) VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT (project_name, key) DO UPDATE SET '
+                               'value = excluded.value, updated_at = excluded.updated_at', rows)
+            if keep_history:
+                cursor.executemany('INSERT INTO project_info_history (project_name, key, value, recorded_at) '
+                                   'VALUES (?, ?, ?, ?)', rows)
+        for key, value in values.items():
+            print(f'... project {project_name} updated: "{key}" = "{value}"')
     except Exception as e:
         print(f'... project could not be updated because of: {e}')
-    finally:
-        if connection:
-            close_connection_to_ddbb(connection)
 
 
 def get_project_info(project_name):
-    connection = None
     try:
-        connection = connect_to_ddbb()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM project_info WHERE project_name = ?', (project_name,))
-        project_info = cursor.fetchall()
-        column_names = [columns[0] for columns in cursor.description]
+        with transaction() as cursor:
+            cursor.execute('SELECT * FROM project_info WHERE project_name = ?', (project_name,))
+            project_info = cursor.fetchall()
+            column_names = [columns[0] for columns in cursor.description]
         return column_names, project_info
     except Exception as e:
         print(f'... could not check projects because of: {e}')
-    finally:
-        if connection:
-            close_connection_to_ddbb(connection)
 
 
-def get_visit_id(project_name):
-    connection = None
+def get_project_keys(project_name, keys):
+    try:
+        keys = list(keys)
+        with transaction() as cursor:
+            cursor.execute(f'SELECT key, value FROM project_info WHERE project_name = ? '
+                           f'AND key IN ({", ".join("?" * len(keys))})', (project_name, *keys))
+            return dict(cursor.fetchall())
+    except Exception as e:
+        print(f'... could not check projects because of: {e}')
+        return {}
+
+
+def get_project_value(project_name, key):
     try:
-        connection = connect_to_ddbb()
-        cursor = connection.cursor()
-        cursor.execute('SELECT value FROM project_info WHERE project_name = ? AND key = "visit_id"', (project_name,))
-        library_metadata = cursor.fetchone()[0]
-        return library_metadata
+        with transaction() as cursor:
+            cursor.execute('SELECT value FROM project_info WHERE project_name = ? AND key = ?', (project_name, key))
+            return cursor.fetchone()[0]
     except Exception as e:
         print(f'... could not check projects because of: {e}')
-    finally:
-        if connection:
-            close_connection_to_ddbb(connection)
+
+
+def get_visit_id(project_name):
+    return get_project_value(project_name, 'visit_id')
 
 
 def get_metadata_path(project_name):
-    connection = None
+    return get_project_value(project_name, 'metadata_path')
+
+
+def get_bucket_id(project_name):
+    return get_project_keys(project_name, ['bucket_id']).get('bucket_id')
+
+
+def save_journal_entry(project_name, bucket_id, node_key, node_uuid, record_id, field_id, content_hash):
+    try:
+        with transaction() as cursor:
+            cursor.execute('INSERT INTO upload_journal VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                           'ON CONFLICT (project_name, bucket_id, node_key) DO UPDATE SET '
+                           'node_uuid = excluded.node_uuid, record_id = excluded.record_id, field_id = excluded.field_id, '
+                           'content_hash = excluded.content_hash, updated_at = excluded.updated_at',
+                           (project_name, bucket_id, node_key, node_uuid, record_id, field_id, content_hash,
+                            datetime.now().isoformat()))
+    except Exception as e:
+        print(f'... upload journal could not be updated because of: {e}')
+
+
+def get_journal_entries(project_name, bucket_id):
+    try:
+        with transaction() as cursor:
+            cursor.execute('SELECT node_key, node_uuid, record_id, field_id, content_hash FROM upload_journal '
+                           'WHERE project_name = ? AND bucket_id = ?', (project_name, bucket_id))
+            column_names = [columns[0] for columns in cursor.description]
+            return {row[0]: dict(zip(column_names, row)) for row in cursor.fetchall()}
+    except Exception as e:
+        print(f'... could not check upload journal because of: {e}')
+        return {}
+
+
+def save_auth_token(base_url, username, token, expires_at):
+    try:
+        with transaction() as cursor:
+            cursor.execute('INSERT INTO auth_tokens VALUES (?, ?, ?, ?) ON CONFLICT (base_url, username) DO UPDATE SET '
+                           'token = excluded.token, expires_at = excluded.expires_at',
+                           (base_url, username, token, expires_at))
+    except Exception as e:
+        print(f'... token could not be saved because of: {e}')
+
+
+def get_auth_token(base_url, username):
+    try:
+        with transaction() as cursor:
+            cursor.execute('SELECT token, expires_at FROM auth_tokens WHERE base_url = ? AND username = ?',
+                           (base_url, username))
+            return cursor.fetchone()
+    except Exception as e:
+        print(f'... could not check tokens because of: {e}')
+
+
+def delete_auth_token(base_url, username):
+    try:
+        with transaction() as cursor:
+            cursor.execute('DELETE FROM auth_tokens WHERE base_url = ? AND username = ?', (base_url, username))
+    except Exception as e:
+        print(f'... token could not be deleted because of: {e}')
+
+
+def save_export_cache(visit_id, metadata_path, etag, last_modified, content_hash):
+    try:
+        with transaction() as cursor:
+            cursor.execute('INSERT INTO export_cache VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (visit_id) DO UPDATE SET '
+                           'metadata_path = excluded.metadata_path, etag = excluded.etag, '
+                           'last_modified = excluded.last_modified, content_hash = excluded.content_hash, '
+                           'updated_at = excluded.updated_at',
+                           (visit_id, metadata_path, etag, last_modified, content_hash, datetime.now().isoformat()))
+    except Exception as e:
+        print(f'... export cache could not be updated because of: {e}')
+
+
+def get_export_cache(visit_id):
+    try:
+        with transaction() as cursor:
+            cursor.execute('SELECT metadata_path, etag, last_modified, content_hash FROM export_cache '
+                           'WHERE visit_id = ?', (visit_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            column_names = [columns[0] for columns in cursor.description]
+            return dict(zip(column_names, row))
+    except Exception as e:
+        print(f'... could not check export cache because of: {e}')
+
+
+def save_upload_run(project_name, bucket_id, started_at, results, records_created, fields_created, nodes_skipped):
+    try:
+        failures = sum(1 for result in results if result['status'] == 'failed')
+        with transaction() as cursor:
+            cursor.execute('INSERT INTO upload_runs (project_name, bucket_id, started_at, finished_at, records_created, '
+                           'fields_created, nodes_skipped, failures) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (project_name, bucket_id, started_at, datetime.now().isoformat(), records_created,
+                            fields_created, nodes_skipped, failures))
+            run_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO upload_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               [(run_id, project_name, bucket_id, result['node_key'], result['node_type'],
+                                 result['status'], result['record_id'], result['field_id'], result['error'])
+                                for result in results])
+        print(f'... upload run {run_id} of project {project_name} saved: {len(results)} nodes, {failures} failed')
+        return run_id
+    except Exception as e:
+        print(f'... upload results could not be saved because of: {e}')
+
+
+def get_upload_runs(project_name, limit=None):
+    try:
+        with transaction() as cursor:
+            cursor.execute('SELECT * FROM upload_runs WHERE project_name = ? ORDER BY id DESC LIMIT ?',
+                           (project_name, -1 if limit is None else limit))
+            column_names = [columns[0] for columns in cursor.description]
+            return column_names, cursor.fetchall()
+    except Exception as e:
+        print(f'... could not check upload runs because of: {e}')
+
+
+def get_upload_summary(project_name, run_id=None):
+    try:
+        with transaction() as cursor:
+            if run_id is None:
+                cursor.execute('SELECT MAX(id) FROM upload_runs WHERE project_name = ?', (project_name,))
+                run_id = cursor.fetchone()[0]
+            cursor.execute('SELECT node_type, status, COUNT(*) FROM upload_results WHERE run_id = ? '
+                           'GROUP BY node_type, status ORDER BY node_type, status', (run_id,))
+            return run_id, cursor.fetchall()
+    except Exception as e:
+        print(f'... could not check upload results because of: {e}')
+
+
+def get_upload_results(project_name, run_id=None, node_type=None, status=None, limit=None):
+    try:
+        query = 'SELECT run_id, node_type, status, node_key, record_id, field_id, error FROM upload_results ' \
+                'WHERE project_name = ?'
+        params = [project_name]
+        for column, value in (('run_id', run_id), ('node_type', node_type), ('status', status)):
+            if value is not None:
+                query += f' AND {column} = ?'
+                params.append(value)
+        query += ' ORDER BY run_id DESC, rowid LIMIT ?'
+        params.append(-1 if limit is None else limit)
+        with transaction() as cursor:
+            cursor.execute(query, params)
+            column_names = [columns[0] for columns in cursor.description]
+            return column_names, cursor.fetchall()
+    except Exception as e:
+        print(f'... could not check upload results because of: {e}')
+
+
+def get_pending_upload_projects():
     try:
-        connection = connect_to_ddbb()
-        cursor = connection.cursor()
-        cursor.execute('SELECT value FROM project_info WHERE project_name = ? AND key = "metadata_path"', (project_name,))
-        library_metadata = cursor.fetchone()[0]
-        return library_metadata
+        with transaction() as cursor:
+            # exported projects without an upload run free of failures since their last export
+            cursor.execute('SELECT project_name FROM project_info p WHERE key = ? AND NOT EXISTS ('
+                           'SELECT 1 FROM upload_runs r WHERE r.project_name = p.project_name AND r.failures = 0 '
+                           'AND r.finished_at >= COALESCE(p.updated_at, \'\')) ORDER BY project_name',
+                           ('metadata_path',))
+            return [row[0] for row in cursor.fetchall()]
     except Exception as e:
         print(f'... could not check projects because of: {e}')
-    finally:
-        if connection:
-            close_connection_to_ddbb(connection)
\ No newline at end of file
+        return []
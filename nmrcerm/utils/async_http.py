@@ -0,0 +1,53 @@
+import importlib
+from typing import Optional
+
+
+def import_aiohttp():
+    """
+    Function that imports aiohttp, which is only needed by the async code paths
+
+    Returns:
+        module: aiohttp
+    """
+
+    try:
+        return importlib.import_module('aiohttp')
+    except ImportError:
+        raise ImportError('the async code path needs the aiohttp package (pip install fandanGO-nmr-cerm[async])')
+
+
+def create_async_session(pool_size: int, verify_ssl: bool = True, headers: dict = None):
+    """
+    Function that creates an aiohttp session whose connection pool keeps up to pool_size
+    connections open and reuses them across requests. It must be created (and closed)
+    inside the running event loop.
+
+    Args:
+        pool_size (int): maximum number of concurrent connections
+        verify_ssl (bool): verify the server certificates
+        headers (dict): headers sent with every request
+
+    Returns:
+        aiohttp.ClientSession: session
+    """
+
+    aiohttp = import_aiohttp()
+    connector = aiohttp.TCPConnector(limit=max(1, int(pool_size)), ssl=None if verify_ssl else False)
+    return aiohttp.ClientSession(connector=connector, headers=headers)
+
+
+def http_status(error: Exception) -> Optional[int]:
+    """
+    Function that reads the HTTP status of an error raised by requests (HTTPError) or by
+    aiohttp (ClientResponseError), so sync and async callers handle them the same way
+
+    Returns:
+        int: status code, None if the error carries no HTTP response
+    """
+
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None) if response is not None else None
+    if status_code is None and isinstance(getattr(error, 'status', None), int):
+        # aiohttp.ClientResponseError
+        status_code = error.status
+    return status_code
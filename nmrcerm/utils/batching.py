@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from fGOaria import Field, Record
+from nmrcerm.constants import DEFAULT_UPLOAD_WORKERS
+from nmrcerm.utils.rate_limiter import AdaptiveRateLimiter, HostConcurrencyLimiter
+
+RECORD_OPERATION = ('createDataRecord', 'CreateRecordInput', 'id, bucket, created, updated, schema')
+FIELD_OPERATION = ('createDataField', 'CreateFieldInput', 'id, record, options, content, type')
+
+
+def build_batch_mutation(operation: str, input_type: str, selection: str, count: int) -> str:
+    """
+    Function that builds one GraphQL document running the same mutation count times, each
+    under its own alias (o0, o1, ...) with its own input variable (i0, i1, ...)
+    """
+
+    params = ', '.join(f'$i{n}: {input_type}!' for n in range(count))
+    operations = '\n'.join(f'    o{n}: {operation}(input: $i{n}) {{ {selection} }}' for n in range(count))
+    return f'mutation({params}) {{\n{operations}\n}}'
+
+
+def record_input(record: Record) -> Dict[str, Any]:
+    return {'bucket': record.bucket_id, 'schema': record.schema_type}
+
+
+def field_input(field: Field) -> Dict[str, Any]:
+    return {'record': field.record_id, 'type': field.field_type, 'content': json.dumps(field.content),
+            'options': field.options}
+
+
+class PushBatcher:
+    """
+    Sends the Records (or Fields) of one tree level to ARIA as a single multi-operation
+    GraphQL request. Operations the server did not execute are retried one by one through
+    a small pool, which is also used for everything once ARIA rejects batched documents.
+    """
+
+    def __init__(self, visit, push_record: Callable, push_field: Callable, push_batch: Optional[Callable] = None,
+                 limiter: Optional[AdaptiveRateLimiter] = None, workers: int = DEFAULT_UPLOAD_WORKERS,
+                 slots: Optional[HostConcurrencyLimiter] = None):
+        self.visit = visit
+        self.push_record = push_record
+        self.push_field = push_field
+        self.push_batch = push_batch
+        self.limiter = limiter
+        self.slots = slots
+        self.supported = push_batch is not None and hasattr(visit, 'client')
+        self.workers = max(1, int(workers))
+        # started on the first one-by-one push, never by the async subclass
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def push_records(self, records: List[Record]) -> List[Optional[Exception]]:
+        """
+        Pushes the records and sets their ids
+
+        Returns:
+            list: for each record, the error that prevented its creation or None
+        """
+
+        return self._push(records, self.push_record, RECORD_OPERATION, record_input, 'records')
+
+    def push_fields(self, fields: List[Field]) -> List[Optional[Exception]]:
+        """
+        Pushes the fields and sets their ids
+
+        Returns:
+            list: for each field, the error that prevented its creation or None
+        """
+
+        return self._push(fields, self.push_field, FIELD_OPERATION, field_input, 'fields')
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown()
+
+    def _push(self, entities, push_one, operation, to_input, registry) -> List[Optional[Exception]]:
+        pending = list(range(len(entities)))
+        if self.supported and len(entities) > 1:
+            try:
+                self._push_batch(entities, operation, to_input, registry)
+            except Exception as e:
+                print(f"✗ Batch of {len(entities)} {registry} failed: {e}")
+            pending = [i for i in pending if entities[i].id is None]
+
+        errors = [None] * len(entities)
+        if pending:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {i: self._executor.submit(push_one, self.visit, entities[i], limiter=self.limiter,
+                                               slots=self.slots) for i in pending}
+        for i, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[i] = e
+        return errors
+
+    def _push_batch(self, entities, operation, to_input, registry):
+        query, variables = self._batch_request(entities, operation, to_input)
+        response = self.push_batch(self.visit, query, variables, limiter=self.limiter, slots=self.slots)
+        self._apply_batch(entities, response, registry)
+
+    @staticmethod
+    def _batch_request(entities, operation, to_input):
+        name, input_type, selection = operation
+        query = build_batch_mutation(name, input_type, selection, len(entities))
+        variables = {f'i{n}': to_input(entity) for n, entity in enumerate(entities)}
+        return query, variables
+
+    def _apply_batch(self, entities, response, registry):
+        data = response.get('data') or {}
+        created = 0
+        for n, entity in enumerate(entities):
+            item = data.get(f'o{n}')
+            if item:
+                entity.populate(item)
+                getattr(self.visit, registry, {})[entity.id] = entity
+                created += 1
+
+        if response.get('errors'):
+            if not created:
+                # the document itself was refused: do not try batching again in this run
+                self.supported = False
+                print(f"✗ ARIA rejected batched {registry}, pushing one by one: {response['errors']}")
+            else:
+                print(f"✗ {len(entities) - created} of {len(entities)} batched {registry} failed, "
+                      f"retrying them one by one")
+
+
+class AsyncPushBatcher(PushBatcher):
+    """
+    PushBatcher for coroutine push functions: the batched request and the one-by-one
+    pushes of what it left are awaited on the running event loop instead of a thread pool.
+    """
+
+    def __init__(self, visit, push_record: Callable, push_field: Callable, push_batch: Optional[Callable] = None,
+                 limiter: Optional[AdaptiveRateLimiter] = None):
+        super().__init__(visit, push_record, push_field, push_batch, limiter)
+
+    async def push_records(self, records: List[Record]) -> List[Optional[Exception]]:
+        return await self._push_async(records, self.push_record, RECORD_OPERATION, record_input, 'records')
+
+    async def push_fields(self, fields: List[Field]) -> List[Optional[Exception]]:
+        return await self._push_async(fields, self.push_field, FIELD_OPERATION, field_input, 'fields')
+
+    async def _push_async(self, entities, push_one, operation, to_input, registry) -> List[Optional[Exception]]:
+        pending = list(range(len(entities)))
+        if self.supported and len(entities) > 1:
+            try:
+                query, variables = self._batch_request(entities, operation, to_input)
+                self._apply_batch(entities, await self.push_batch(self.visit, query, variables, limiter=self.limiter),
+                                  registry)
+            except Exception as e:
+                print(f"✗ Batch of {len(entities)} {registry} failed: {e}")
+            pending = [i for i in pending if entities[i].id is None]
+
+        errors = [None] * len(entities)
+        results = await asyncio.gather(*(push_one(self.visit, entities[i], limiter=self.limiter) for i in pending),
+                                       return_exceptions=True)
+        for i, result in zip(pending, results):
+            if isinstance(result, Exception):
+                errors[i] = result
+        return errors
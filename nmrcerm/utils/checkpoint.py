@@ -0,0 +1,89 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from nmrcerm.db.sqlite_db import get_journal_entries, save_journal_entry
+
+
+def content_hash(data: Dict[str, Any]) -> str:
+    """
+    Function that computes a stable hash of a node payload
+
+    Args:
+        data (dict): JSON payload of the node
+
+    Returns:
+        str: sha256 hex digest of the canonical JSON encoding
+    """
+
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def split_field_ids(field_id: Optional[str]) -> List[Optional[str]]:
+    """
+    Function that reads the field_id journaled for a node: the ids of its Fields, comma
+    separated, with an empty slot for each part of a split payload not pushed yet
+
+    Returns:
+        list: one id (or None) per Field, empty if no Field was pushed
+    """
+
+    return [part or None for part in field_id.split(',')] if field_id else []
+
+
+NODE_NEW = 'new'
+NODE_CHANGED = 'changed'
+NODE_INCOMPLETE = 'incomplete'
+NODE_UNCHANGED = 'unchanged'
+
+
+class UploadCheckpoint:
+    """
+    Journal of the nodes pushed to one ARIA bucket, stored in the plugin database. It is
+    the last-synced state of the project: an interrupted upload can be resumed, and a
+    re-exported visit only pushes the nodes whose content hash changed.
+    """
+
+    def __init__(self, project_name: str, bucket_id: str, resume: bool = False):
+        self.project_name = project_name
+        self.bucket_id = bucket_id
+        self.entries = get_journal_entries(project_name, bucket_id) if resume else {}
+        self.seen_keys = set()
+
+    def node_uuid(self, node_key: str) -> Optional[str]:
+        entry = self.entries.get(node_key)
+        return entry['node_uuid'] if entry else None
+
+    def status(self, node) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Compares a node against the journal
+
+        Returns:
+            tuple: node status (new, changed, incomplete or unchanged) and its journal entry
+        """
+
+        self.seen_keys.add(node.key)
+        entry = self.entries.get(node.key)
+        if not entry:
+            return NODE_NEW, None
+        if entry['content_hash'] != node.content_hash:
+            return NODE_CHANGED, entry
+        field_ids = split_field_ids(entry['field_id'])
+        if not field_ids or None in field_ids:
+            return NODE_INCOMPLETE, entry
+        return NODE_UNCHANGED, entry
+
+    def removed_keys(self) -> List[str]:
+        """
+        Returns the journaled nodes that were not part of the last upload
+        """
+
+        return sorted(set(self.entries) - self.seen_keys)
+
+    def record_pushed(self, node, record_id: str):
+        save_journal_entry(self.project_name, self.bucket_id, node.key, node.uuid, record_id, None,
+                           node.content_hash)
+
+    def field_pushed(self, node, record_id: str, field_id: str):
+        save_journal_entry(self.project_name, self.bucket_id, node.key, node.uuid, record_id, field_id,
+                           node.content_hash)
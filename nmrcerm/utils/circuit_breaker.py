@@ -0,0 +1,165 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+import requests
+from nmrcerm.constants import CIRCUIT_FAIL_FAST, CIRCUIT_PAUSE, CIRCUIT_FAILURE_RATE, CIRCUIT_WINDOW, \
+    CIRCUIT_MIN_CALLS, CIRCUIT_OPEN_TIMEOUT, CIRCUIT_MAX_OPEN_TIMEOUT, CIRCUIT_PAUSE_TIMEOUT, CIRCUIT_JITTER
+from nmrcerm.utils.async_http import http_status
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit is open. It is never retried.
+    """
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """
+    Function that tells if an error says something about the health of the server: the
+    request could not be sent or answered (connection error, timeout), or the server
+    answered 429 or 5xx. Other HTTP errors, GraphQL errors and invalid payloads are about
+    the request itself and do not count.
+
+    Args:
+        error (Exception): error raised by a request
+
+    Returns:
+        bool: True if the error counts towards opening the circuit
+    """
+
+    status_code = http_status(error)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    transport_errors = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError,
+                        asyncio.TimeoutError)
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is not None:
+        transport_errors += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+    return isinstance(error, transport_errors)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by every request of a run. It opens when at least failure_rate
+    of the last window requests (and at least min_calls of them) failed because of the
+    backend. While open, requests either fail at once with CircuitOpenError (fail-fast)
+    or wait (pause); once the backend has been unavailable for pause_timeout seconds,
+    waiting requests fail too. After a jittered open timeout, which
+    doubles each time a probe fails, half_open_probes requests are let through: a success
+    closes the circuit, a failure opens it again.
+    """
+
+    def __init__(self, mode: str = CIRCUIT_FAIL_FAST, failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 window: int = CIRCUIT_WINDOW, min_calls: int = CIRCUIT_MIN_CALLS,
+                 open_timeout: float = CIRCUIT_OPEN_TIMEOUT, max_open_timeout: float = CIRCUIT_MAX_OPEN_TIMEOUT,
+                 pause_timeout: float = CIRCUIT_PAUSE_TIMEOUT, half_open_probes: int = 1,
+                 jitter: float = CIRCUIT_JITTER):
+        if mode not in (CIRCUIT_FAIL_FAST, CIRCUIT_PAUSE):
+            raise ValueError(f"unknown circuit breaker mode '{mode}', use {CIRCUIT_FAIL_FAST} or {CIRCUIT_PAUSE}")
+        self.mode = mode
+        self.failure_rate = float(failure_rate)
+        self.min_calls = max(1, int(min_calls))
+        self.open_timeout = float(open_timeout)
+        self.max_open_timeout = max(float(max_open_timeout), self.open_timeout)
+        self.pause_timeout = float(pause_timeout)
+        self.half_open_probes = max(1, int(half_open_probes))
+        self.jitter = jitter
+        self.state = STATE_CLOSED
+        self.times_opened = 0
+        self._outcomes = deque(maxlen=max(self.min_calls, int(window)))
+        self._consecutive_opens = 0
+        self._retry_at = 0.0
+        self._open_since = None
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Blocks, in pause mode, until a request may be sent
+
+        Raises:
+            CircuitOpenError: the circuit is open and the request must not be sent
+        """
+
+        while True:
+            wait = self._admit()
+            if wait is None:
+                return
+            time.sleep(wait)
+
+    async def before_call_async(self):
+        """
+        Same as before_call, waiting without blocking the event loop
+        """
+
+        while True:
+            wait = self._admit()
+            if wait is None:
+                return
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                print('✓ Circuit closed, backend is responding again')
+                self.state = STATE_CLOSED
+                self._outcomes.clear()
+                self._consecutive_opens = 0
+                self._open_since = None
+                self._probes = 0
+            self._outcomes.append(False)
+
+    def on_failure(self, error: Exception = None):
+        if error is not None and not is_backend_failure(error):
+            self.on_success()
+            return
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._open(f"probe failed: {error}")
+                return
+            self._outcomes.append(True)
+            if self.state == STATE_CLOSED and len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._open(f"{sum(self._outcomes)} of the last {len(self._outcomes)} requests failed")
+
+    def _admit(self):
+        """
+        Returns:
+            float: seconds to wait before asking again, None if the request may go
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if self.state == STATE_CLOSED:
+                return None
+            if self.state == STATE_OPEN and now >= self._retry_at:
+                self.state = STATE_HALF_OPEN
+                self._probes = 0
+            if self.state == STATE_HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return None
+            deadline = self._open_since + self.pause_timeout
+            if self.mode == CIRCUIT_FAIL_FAST or now >= deadline:
+                raise CircuitOpenError(f"circuit open, backend unavailable (retry in "
+                                       f"{max(0.0, self._retry_at - now):.1f}s)")
+            # wake up when the probe window opens, or now and then while a probe is running
+            return min(max(self._retry_at - now, 0.1), deadline - now, 1.0)
+
+    def _open(self, reason: str):
+        timeout = min(self.max_open_timeout, self.open_timeout * 2 ** self._consecutive_opens)
+        timeout *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.state = STATE_OPEN
+        self.times_opened += 1
+        self._consecutive_opens += 1
+        self._retry_at = time.monotonic() + timeout
+        if self._open_since is None:
+            self._open_since = time.monotonic()
+        self._probes = 0
+        print(f"✗ Circuit opened ({reason}), probing again in {timeout:.1f}s")
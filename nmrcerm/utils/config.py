@@ -0,0 +1,47 @@
+import configparser
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'config.yaml')
+
+
+@lru_cache(maxsize=None)
+def load_config() -> configparser.ConfigParser:
+    """
+    Function that loads the .env variables and parses config.yaml, once per process. The
+    NMRCERM_CONFIG environment variable (or .env entry) points to another config file.
+
+    Returns:
+        ConfigParser: plugin configuration
+    """
+
+    load_dotenv()
+    config = configparser.ConfigParser()
+    config.read(os.getenv('NMRCERM_CONFIG') or CONFIG_PATH)
+    return config
+
+
+def get_setting(section: str, key: str, default: str = None) -> str:
+    """
+    Function that returns a config.yaml value
+
+    Args:
+        section (str): section name, e.g. DDBB
+        key (str): key inside the section, e.g. DDBB_PATH
+        default (str): value used when the section or the key is missing
+
+    Returns:
+        str: configured value
+    """
+
+    config = load_config()
+    if not config.has_section(section):
+        return default
+    return config[section].get(key, default)
+
+
+def get_env(name: str, default: str = None) -> str:
+    """Function that returns an environment variable, once the .env file has been loaded"""
+    load_config()
+    return os.getenv(name, default)
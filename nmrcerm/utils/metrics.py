@@ -0,0 +1,125 @@
+import json
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Function that returns the nearest-rank percentile of an already sorted list
+    """
+
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Metrics:
+    """
+    Process-wide registry of operation latencies and counters for the export and upload
+    paths. Throughput is computed over the span between the first and the last observation.
+    """
+
+    def __init__(self):
+        self._timings = defaultdict(list)
+        self._counters = Counter()
+        self._first = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            self._timings[name].append(seconds)
+            if self._first is None or now - seconds < self._first:
+                self._first = now - seconds
+            self._last = now if self._last is None else max(self._last, now)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def timed(self, name: str = None):
+        """
+        Decorator that times every call of the decorated function
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+            self._first = self._last = None
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: wall time covered, per operation count, ops/sec and latency percentiles, and counters
+        """
+
+        with self._lock:
+            timings = {name: sorted(values) for name, values in self._timings.items()}
+            counters = dict(self._counters)
+            elapsed = (self._last - self._first) if self._first is not None else 0.0
+
+        operations = {}
+        for name, values in timings.items():
+            total = sum(values)
+            operations[name] = {
+                'count': len(values),
+                'ops_per_sec': round(len(values) / elapsed, 3) if elapsed else None,
+                'total_s': round(total, 6),
+                'mean_s': round(total / len(values), 6),
+                'p50_s': round(percentile(values, 0.50), 6),
+                'p95_s': round(percentile(values, 0.95), 6),
+                'p99_s': round(percentile(values, 0.99), 6),
+                'max_s': round(values[-1], 6),
+            }
+        return {'elapsed_s': round(elapsed, 6), 'operations': operations, 'counters': counters}
+
+    def to_prometheus(self) -> str:
+        summary = self.summary()
+        lines = ['# TYPE nmrcerm_operation_seconds summary']
+        for name, op in summary['operations'].items():
+            for quantile, key in (('0.5', 'p50_s'), ('0.95', 'p95_s'), ('0.99', 'p99_s')):
+                lines.append(f'nmrcerm_operation_seconds{{operation="{name}",quantile="{quantile}"}} {op[key]}')
+            lines.append(f'nmrcerm_operation_seconds_sum{{operation="{name}"}} {op["total_s"]}')
+            lines.append(f'nmrcerm_operation_seconds_count{{operation="{name}"}} {op["count"]}')
+        lines.append('# TYPE nmrcerm_events_total counter')
+        for name, value in summary['counters'].items():
+            lines.append(f'nmrcerm_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Writes the summary to path, as Prometheus text if it ends in .prom or .txt, else as JSON
+        """
+
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+
+
+metrics = Metrics()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+from nmrcerm.constants import DEFAULT_MAX_FIELD_BYTES, PAYLOAD_SPLIT, PAYLOAD_EXTERNALISE, DEFAULT_OVERSIZED_PAYLOAD
+from nmrcerm.utils.metrics import metrics
+
+# approximate size of a sidecar reference: moving smaller values out would grow the Field
+SIDECAR_REFERENCE_BYTES = 160
+
+
+def payload_size(content: Any) -> int:
+    """Size in bytes of a Field content once encoded for ARIA"""
+    return len(json.dumps(content).encode('utf-8'))
+
+
+class PayloadPlanner:
+    """
+    Decides the JSON Field contents of a node. Payloads up to max_field_bytes are pushed
+    as one Field. Larger ones are either split by top-level keys into several Fields of the
+    same Record (split), or have their largest top-level values written to sidecar files
+    under sidecar_dir and replaced by a reference (externalise). With split, a single value
+    that does not fit in a Field on its own fails the node, as ARIA would not get it; with
+    externalise, what still does not fit once the large values are out is split. The
+    values moved out are kept in externalised so the upload can report them.
+    """
+
+    def __init__(self, max_field_bytes: int = DEFAULT_MAX_FIELD_BYTES, oversized: str = DEFAULT_OVERSIZED_PAYLOAD,
+                 sidecar_dir: Optional[str] = None):
+        if oversized not in (PAYLOAD_SPLIT, PAYLOAD_EXTERNALISE):
+            raise ValueError(f"unknown oversized payload policy '{oversized}', use {PAYLOAD_SPLIT} or "
+                             f"{PAYLOAD_EXTERNALISE}")
+        self.max_field_bytes = int(max_field_bytes)
+        self.oversized = oversized
+        self.sidecar_dir = sidecar_dir
+        self.externalised = []
+        self._lock = threading.Lock()
+
+    def plan(self, node_key: str, data: Dict[str, Any], dry_run: bool = False) -> List[Dict[str, Any]]:
+        """
+        Function that returns the contents of the Fields to push for a node
+
+        Args:
+            node_key (str): key of the node in the upload tree, used in messages
+            data (dict): JSON payload of the node
+            dry_run (bool): plan without writing sidecar files (pre-flight), the contents are the same
+
+        Returns:
+            list: one content per Field, in order
+
+        Raises:
+            ValueError: with split, a top-level value does not fit in a Field on its own
+        """
+
+        if payload_size(data) <= self.max_field_bytes:
+            return [data]
+        metrics.increment('fields_oversized')
+        if self.oversized == PAYLOAD_EXTERNALISE:
+            data = self._externalise(node_key, data, dry_run)
+            if payload_size(data) <= self.max_field_bytes:
+                return [data]
+        return self._split(node_key, data)
+
+    def _split(self, node_key: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Packs the top-level keys, in order, into as few Fields as fit in max_field_bytes"""
+        parts = []
+        part, part_size = {}, 2
+        for key, value in data.items():
+            item_size = payload_size({key: value})
+            if item_size > self.max_field_bytes:
+                raise ValueError(f"'{key}' ({item_size} bytes) does not fit in a field of {self.max_field_bytes} "
+                                 f"bytes, raise --max_field_size or use --oversized {PAYLOAD_EXTERNALISE}")
+            # '{"key": value}' without its braces, plus the ', ' separator after the first key
+            extra = item_size if part else item_size - 2
+            if part and part_size + extra > self.max_field_bytes:
+                parts.append(part)
+                part, part_size = {}, 2
+                extra = item_size - 2
+            part[key] = value
+            part_size += extra
+        if part or not parts:
+            parts.append(part)
+        return parts
+
+    def _externalise(self, node_key: str, data: Dict[str, Any], dry_run: bool = False) -> Dict[str, Any]:
+        """Moves the largest top-level values to sidecar files until the rest fits in max_field_bytes"""
+        content = dict(data)
+        sizes = {key: payload_size(value) for key, value in data.items()}
+        for key in sorted(sizes, key=sizes.get, reverse=True):
+            if sizes[key] <= SIDECAR_REFERENCE_BYTES or payload_size(content) <= self.max_field_bytes:
+                break
+            content[key] = self._sidecar(node_key, key, data[key], dry_run)
+        return content
+
+    def _sidecar(self, node_key: str, key: str, value: Any, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Writes a value to a sidecar file, named after its hash so identical values are stored once
+
+        Returns:
+            dict: reference that replaces the value in the Field
+        """
+
+        if not self.sidecar_dir:
+            raise ValueError(f"{node_key}: '{key}' is larger than {self.max_field_bytes} bytes and there is no "
+                             f"sidecar directory to move it to")
+        encoded = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        file_name = f"{digest}.json"
+        path = os.path.join(self.sidecar_dir, file_name)
+        reference = {'sidecar': file_name, 'sha256': digest, 'bytes': len(encoded)}
+        if dry_run:
+            return reference
+        if not os.path.exists(path):
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.sidecar_dir, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        metrics.increment('fields_externalised')
+        with self._lock:
+            self.externalised.append({'node': node_key, 'key': key, 'bytes': len(encoded), 'path': path})
+        print(f"↪ {node_key}: '{key}' ({len(encoded)} bytes) moved to {path}")
+        return reference
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from nmrcerm.constants import DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, MIN_RATE_LIMIT, MAX_RATE_LIMIT, \
+    RATE_LIMIT_INCREASE, RATE_LIMIT_DECREASE, DEFAULT_HOST_CONCURRENCY
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Function that tells if an error means the server is overloaded (HTTP 429 or 5xx)
+
+    Args:
+        error (Exception): error raised by a push (requests HTTPError or aiohttp ClientResponseError)
+
+    Returns:
+        bool: True if the server asked us to slow down
+    """
+
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', getattr(error, 'status', None))
+    if status_code is None:
+        return False
+    return status_code == 429 or status_code >= 500
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every ARIA push of a run. The refill rate follows AIMD: it
+    grows additively on each successful push, up to max_rate, and is cut multiplicatively
+    when a push fails, at most once per second so a burst of concurrent failures counts
+    as a single congestion signal.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_RATE_BURST,
+                 min_rate: float = MIN_RATE_LIMIT, max_rate: float = MAX_RATE_LIMIT,
+                 increase: float = RATE_LIMIT_INCREASE, decrease: float = RATE_LIMIT_DECREASE):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_rate = min(float(min_rate), self.rate)
+        self.max_rate = max(float(max_rate), self.rate)
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request may be sent
+
+        Returns:
+            float: seconds spent waiting for a token
+        """
+
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait is None:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self) -> float:
+        """
+        Same as acquire, waiting without blocking the event loop
+        """
+
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait is None:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def _take(self):
+        """Takes a token, or returns how long to wait for the next one"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.rate
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_failure(self, error: Exception = None):
+        with self._lock:
+            self._refill()
+            now = time.monotonic()
+            if now - self._last_decrease >= 1:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            if error is not None and is_throttling_error(error):
+                self._tokens = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+class HostConcurrencyLimiter:
+    """
+    Caps the number of requests in flight to each host. One instance is shared by all the
+    uploads of a scheduler run, so the cap holds whatever the number of projects and workers.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_HOST_CONCURRENCY):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, url: str = None):
+        """
+        Holds one of the slots of the host of url while the block runs
+
+        Yields:
+            float: seconds spent waiting for the slot
+        """
+
+        host = urlparse(url).netloc if url else ''
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.max_concurrent))
+        start = time.monotonic()
+        with semaphore:
+            yield time.monotonic() - start
@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import importlib
+import json
+import os
+from contextlib import ExitStack, contextmanager
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Tuple
+import ijson
+from nmrcerm.constants import METADATA_FORMATS, DEFAULT_METADATA_FORMAT
+
+
+def metadata_extension(storage_format: str = DEFAULT_METADATA_FORMAT) -> str:
+    """
+    Function that returns the file extension recording a storage format in a metadata path
+
+    Args:
+        storage_format (str): one of METADATA_FORMATS
+
+    Returns:
+        str: extension, including the leading dot
+    """
+
+    if storage_format not in METADATA_FORMATS:
+        raise ValueError(f"unknown metadata format '{storage_format}', use one of: {', '.join(METADATA_FORMATS)}")
+    return METADATA_FORMATS[storage_format]
+
+
+def metadata_format(path: str) -> str:
+    """
+    Function that tells the storage format of a metadata file from its extension. Files
+    with a plain .json extension are read as JSON whether they are indented or not.
+    """
+
+    for storage_format, extension in sorted(METADATA_FORMATS.items(), key=lambda item: -len(item[1])):
+        if path.endswith(extension):
+            return storage_format
+    raise ValueError(f"unknown metadata format for {path}")
+
+
+def _optional_module(name: str, storage_format: str):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise ImportError(f"the '{storage_format}' metadata format needs the {name} package (pip install {name})")
+
+
+@contextmanager
+def _open_binary(path: str, mode: str, storage_format: str):
+    """Opens path for binary reading/writing, (de)compressing it if the format asks for it"""
+    with open(path, mode) as raw:
+        if storage_format == 'gzip':
+            # mtime=0 keeps the output identical for identical content
+            with gzip.GzipFile(fileobj=raw, mode=mode, mtime=0) as f:
+                yield f
+        elif storage_format == 'zstd':
+            zstandard = _optional_module('zstandard', storage_format)
+            if 'w' in mode:
+                with zstandard.ZstdCompressor().stream_writer(raw, closefd=False) as f:
+                    yield f
+            else:
+                with zstandard.ZstdDecompressor().stream_reader(raw, closefd=False) as f:
+                    yield f
+        else:
+            yield raw
+
+
+class SamplesWriter:
+    """
+    Writes samples one by one to a metadata file, in the storage format given by the
+    extension of its path: JSON arrays (plain, gzip or zstd compressed) or a stream of
+    msgpack objects, one per sample. The file is written aside and moved into place when
+    the writer is closed, unless its content hash equals previous_hash, in which case the
+    existing file is kept. The hash is the sha256 of the samples' compact JSON
+    serialisation, so it does not depend on the storage format.
+    """
+
+    def __init__(self, path: str, previous_hash: str = None):
+        self.path = path
+        self.previous_hash = previous_hash
+        self.storage_format = metadata_format(path)
+        self.count = 0
+        self.content_hash = None
+        self._tmp_path = f"{path}.part"
+        self._digest = hashlib.sha256()
+        self._packer = _optional_module('msgpack', self.storage_format).Packer() \
+            if self.storage_format == 'msgpack' else None
+        self._stack = ExitStack()
+        self._file = None
+
+    def __enter__(self):
+        self._file = self._stack.enter_context(_open_binary(self._tmp_path, 'wb', self.storage_format))
+        if not self._packer:
+            self._file.write(b'[')
+        return self
+
+    def write(self, sample: Dict[str, Any]):
+        chunk = json.dumps(sample, separators=(',', ':')).encode('utf-8')
+        self._digest.update(chunk)
+        if self._packer:
+            self._file.write(self._packer.pack(sample))
+        else:
+            self._file.write(b',\n' + chunk if self.count else chunk)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and not self._packer:
+                self._file.write(b']')
+            self._stack.close()
+            if exc_type is None:
+                self.content_hash = self._digest.hexdigest()
+                if self.content_hash != self.previous_hash or not os.path.exists(self.path):
+                    os.replace(self._tmp_path, self.path)
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def write_samples(path: str, samples: Iterable[Dict[str, Any]], previous_hash: str = None) -> Tuple[int, str]:
+    """
+    Function that writes samples one by one, so the export never has to be held in memory
+    as a whole (see SamplesWriter)
+
+    Args:
+        path (str): destination file, its extension gives the storage format
+        samples (iterable): samples to write
+        previous_hash (str): content hash of the file currently at path, if any
+
+    Returns:
+        tuple: number of samples read and sha256 of their compact JSON serialisation
+    """
+
+    with SamplesWriter(path, previous_hash) as writer:
+        for sample in samples:
+            writer.write(sample)
+    return writer.count, writer.content_hash
+
+
+async def write_samples_async(path: str, samples: AsyncIterable[Dict[str, Any]],
+                              previous_hash: str = None) -> Tuple[int, str]:
+    """
+    Function that writes samples received from an async iterator, e.g. an export streamed
+    by aiohttp (see write_samples)
+    """
+
+    with SamplesWriter(path, previous_hash) as writer:
+        async for sample in samples:
+            writer.write(sample)
+    return writer.count, writer.content_hash
+
+
+def iter_samples(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Function that yields the samples of a metadata file one at a time
+
+    Args:
+        path (str): file written by write_samples, in any of the METADATA_FORMATS
+
+    Returns:
+        iterator: samples, parsed incrementally
+    """
+
+    storage_format = metadata_format(path)
+    with _open_binary(path, 'rb', storage_format) as f:
+        if storage_format == 'msgpack':
+            yield from _optional_module('msgpack', storage_format).Unpacker(f, raw=False)
+        else:
+            yield from ijson.items(f, 'item', use_float=True)
+
+
+def iter_export_samples(stream) -> Iterator[Dict[str, Any]]:
+    """
+    Function that yields the entries of the "samples" array of a CERM export as they are read
+
+    Args:
+        stream: binary file-like object with the export JSON (e.g. a streamed HTTP body)
+
+    Returns:
+        iterator: samples, parsed incrementally
+    """
+
+    yield from ijson.items(stream, 'samples.item', use_float=True)
+
+
+def iter_export_samples_async(stream) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Function that yields the entries of the "samples" array of a CERM export read from an
+    async stream (any object with a coroutine read(), e.g. aiohttp's response.content)
+    """
+
+    return ijson.items_async(stream, 'samples.item', use_float=True)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+import weakref
+from typing import Awaitable, Callable, Optional
+import jwt
+from nmrcerm.constants import TOKEN_EXPIRY_MARGIN
+from nmrcerm.db.sqlite_db import save_auth_token, get_auth_token, delete_auth_token
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """
+    Function that reads the "exp" claim of a JWT without verifying its signature
+
+    Args:
+        token (str): JWT
+
+    Returns:
+        float: expiry as a unix timestamp, None if the token has no (readable) expiry
+    """
+
+    try:
+        exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        return float(exp) if exp is not None else None
+    except jwt.PyJWTError:
+        return None
+
+
+class TokenCache:
+    """
+    JWT cache keyed by (base url, username), kept in memory and, if persist is set (opt-in,
+    the token is stored unencrypted), in the plugin database so consecutive runs share it. A token is reused until TOKEN_EXPIRY_MARGIN
+    seconds before its "exp"; tokens without expiry are never cached.
+    """
+
+    def __init__(self, persist: bool = False, margin: float = TOKEN_EXPIRY_MARGIN):
+        self.persist = persist
+        self.margin = margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    def get_token(self, base_url: str, username: str, login: Callable[[], str], rejected: str = None) -> str:
+        """
+        Returns a valid token, logging in only if there is none
+
+        Args:
+            base_url (str): server the token is for
+            username (str): user the token is for
+            login (callable): performs the login and returns a new token
+            rejected (str): token the server just refused (e.g. with a 401); it is dropped
+                unless another thread already replaced it
+
+        Returns:
+            str: JWT
+        """
+
+        with self._lock:
+            token = self._cached(base_url, username, rejected)
+            if token is None:
+                token = login()
+                self._store(base_url, username, token)
+            return token
+
+    async def get_token_async(self, base_url: str, username: str, login: Callable[[], Awaitable[str]],
+                              rejected: str = None) -> str:
+        """
+        Same as get_token with a coroutine login; concurrent callers of the same event loop
+        wait for a single login
+        """
+
+        async with self._async_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock()):
+            with self._lock:
+                token = self._cached(base_url, username, rejected)
+            if token is None:
+                token = await login()
+                with self._lock:
+                    self._store(base_url, username, token)
+            return token
+
+    def _cached(self, base_url: str, username: str, rejected: str = None) -> Optional[str]:
+        key = (base_url, username)
+        cached = self._tokens.get(key)
+        if cached is None and self.persist:
+            cached = get_auth_token(base_url, username)
+        if cached and cached[0] != rejected and cached[1] - self.margin > time.time():
+            self._tokens[key] = cached
+            return cached[0]
+        return None
+
+    def _store(self, base_url: str, username: str, token: str):
+        key = (base_url, username)
+        expires_at = token_expiry(token)
+        if expires_at is None:
+            self._tokens.pop(key, None)
+            if self.persist:
+                delete_auth_token(base_url, username)
+        else:
+            self._tokens[key] = (token, expires_at)
+            if self.persist:
+                save_auth_token(base_url, username, token, expires_at)
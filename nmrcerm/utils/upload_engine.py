@@ -0,0 +1,459 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from fGOaria import Field, Record
+from nmrcerm.constants import DEFAULT_UPLOAD_WORKERS, DEFAULT_BATCH_SIZE, UPLOAD_PROGRESS_STEPS, \
+    MAX_VALIDATION_MESSAGES
+from nmrcerm.utils.batching import PushBatcher
+from nmrcerm.utils.checkpoint import UploadCheckpoint, content_hash, split_field_ids, NODE_NEW, NODE_UNCHANGED
+from nmrcerm.utils.metrics import metrics
+from nmrcerm.utils.payload_planner import PayloadPlanner, payload_size
+from nmrcerm.utils.validation import ExportValidationError
+
+RESULT_CREATED = 'created'
+RESULT_UPDATED = 'updated'
+RESULT_FAILED = 'failed'
+
+
+class UploadNode:
+    """
+    One node of the sample → dataset → experiment tree: an ARIA Record, the JSON Field
+    attached to it and the child nodes that can only be pushed once the Record exists
+    """
+
+    def __init__(self, node_type: str, key: str, label: str, record_name: str, data: Dict[str, Any],
+                 detail: Dict[str, Any], summary: str, description: Optional[str] = None,
+                 children: Optional[List['UploadNode']] = None, node_uuid: Optional[str] = None):
+        self.node_type = node_type
+        self.key = key
+        self.uuid = node_uuid
+        self.label = label
+        self.record_name = record_name
+        self.data = data
+        self.detail = detail
+        self.summary = summary
+        self.description = description
+        self.children = children or []
+        self.content_hash = content_hash(data)
+
+    def size(self) -> int:
+        """Number of nodes of the subtree rooted at this node"""
+        return 1 + sum(child.size() for child in self.children)
+
+
+def build_upload_tree(samples_data: Iterable[Dict[str, Any]],
+                      checkpoint: Optional[UploadCheckpoint] = None) -> Iterator[UploadNode]:
+    """
+    Function that turns the CERM samples export into sample nodes, one sample at a time
+
+    Args:
+        samples_data (iterable): samples as exported by generate-experiment-metadata
+        checkpoint (UploadCheckpoint): journal of a previous run, whose sample uuids are reused
+
+    Returns:
+        iterator: one UploadNode per sample, with datasets and experiments as children
+    """
+
+    for sample in samples_data:
+        sample_name = sample['name']
+        sample_key = f"sample/{sample_name}"
+        sample_uuid = (checkpoint and checkpoint.node_uuid(sample_key)) or str(uuid.uuid4())
+        sample_data = {k: v for k, v in sample.items() if k != 'experimentDTO'}
+
+        sample_node = UploadNode('sample', sample_key, f"Sample {sample_name}", f"{sample_name}: {sample_uuid}",
+                                 sample_data, {'type': 'sample', 'name': sample_name, 'uuid': sample_uuid},
+                                 f'Sample data for {sample_name}', node_uuid=sample_uuid)
+
+        for experiment_dto in sample.get('experimentDTO') or []:
+            dataset_id = experiment_dto['id']
+            dataset_key = f"{sample_key}/dataset/{dataset_id}"
+            # experiments are records of their own, the dataset field does not repeat them
+            dataset_data = {k: v for k, v in experiment_dto.items() if k != 'experimentList'}
+            dataset_node = UploadNode('dataset', dataset_key, f"Dataset {dataset_id}",
+                                      f"dataset_{dataset_id}_experiment_{sample_uuid}", dataset_data,
+                                      {'type': 'dataset', 'dataset_id': dataset_id, 'parent_uuid': sample_uuid},
+                                      f"{sample_name}_Dataset_{dataset_id}",
+                                      description=f"{sample_name}_Dataset_{dataset_id}")
+
+            for experiment in experiment_dto.get('experimentList') or []:
+                expno = experiment['expno']
+                dataset_node.children.append(
+                    UploadNode('experiment', f"{dataset_key}/experiment/{expno}",
+                               f"Experiment {expno} in dataset {dataset_id}",
+                               f"experiment_{expno}_dataset_{dataset_id}", experiment,
+                               {'type': 'experiment', 'expno': expno, 'dataset_id': dataset_id},
+                               f'Experiment {expno} data'))
+
+            sample_node.children.append(dataset_node)
+        yield sample_node
+
+
+def walk(nodes: Iterable[UploadNode]) -> Iterator[UploadNode]:
+    """Every node of the trees rooted at nodes, parents before their children"""
+    for node in nodes:
+        yield node
+        yield from walk(node.children)
+
+
+def plan_payloads(nodes: Iterable[UploadNode], planner: PayloadPlanner) -> Dict[str, int]:
+    """
+    Function that plans the Fields of every node without writing sidecar files, so the
+    Records and Fields of the upload are known, and a payload that cannot be pushed stops
+    it, before a bucket is created
+
+    Args:
+        nodes (iterable): root nodes (samples) of the upload tree
+        planner (PayloadPlanner): planner the upload will use
+
+    Returns:
+        dict: Records and Fields an upload from scratch creates (--delta/--resume skip the unchanged nodes)
+
+    Raises:
+        ExportValidationError: some nodes cannot be planned (e.g. a value too large for a Field under split)
+    """
+
+    records = fields = 0
+    errors = []
+    error_count = 0
+    for node in walk(nodes):
+        try:
+            fields += len(planner.plan(node.key, node.data, dry_run=True))
+            records += 1
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < MAX_VALIDATION_MESSAGES:
+                errors.append(f"{node.key}: {e}")
+    if error_count:
+        raise ExportValidationError(errors, error_count)
+    return {'records': records, 'fields': fields}
+
+
+def flatten(lists: Iterable[List[Any]]) -> List[Any]:
+    return [item for items in lists for item in items]
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UploadEngine:
+    """
+    Pushes an upload tree to ARIA through a bounded worker pool. Each task is a group of up
+    to batch_size sibling nodes: their Records are pushed first, through the batcher, then
+    the children of each node whose Record exists are scheduled while the Fields of the
+    group are pushed, so a Field push is never on the path from a Record to its children
+    and independent branches of the tree are uploaded concurrently. With a checkpoint, every
+    pushed Record and Field is journaled, nodes already committed with the same content are
+    skipped and changed nodes get a new Field on their existing Record. The outcome of every
+    pushed node (ids only, no payloads) is kept in results for the upload history. Given
+    the planned number of nodes (see SampleValidator), progress and ETA are printed as
+    nodes are pushed, skipped or fail. The planner decides the Field contents of each
+    node before its Record is pushed: oversized payloads become several Fields of the same
+    Record or are moved to sidecar files, and a node that cannot be planned fails with
+    nothing created in ARIA.
+    """
+
+    def __init__(self, bucket_id: str, batcher: PushBatcher, workers: int = DEFAULT_UPLOAD_WORKERS,
+                 checkpoint: Optional[UploadCheckpoint] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 planned: Optional[int] = None, planner: Optional[PayloadPlanner] = None):
+        self.bucket_id = bucket_id
+        self.batcher = batcher
+        self.workers = max(1, int(workers))
+        self.checkpoint = checkpoint
+        self.batch_size = max(1, int(batch_size))
+        self.created_records = []
+        self.created_fields = []
+        self.failed_operations = []
+        self.results = []
+        self.node_status = Counter()
+        self.planned = planned
+        self.planner = planner or PayloadPlanner()
+        self.nodes_settled = 0
+        self._started = time.monotonic()
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Condition()
+
+    def run(self, nodes: Iterable[UploadNode]):
+        """
+        Uploads every node and waits until the whole tree has been processed
+
+        Args:
+            nodes (iterable): root nodes (samples) of the upload tree
+
+        Returns:
+            tuple: created records, created fields and failed operations
+        """
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self._executor = executor
+            for group in chunked(nodes, self.batch_size):
+                # roots are read lazily: only take the next samples once the queue has room
+                with self._lock:
+                    while self._pending >= self.workers * 2:
+                        self._lock.wait()
+                self._submit(group)
+            with self._lock:
+                while self._pending:
+                    self._lock.wait()
+        self._executor = None
+        return self.created_records, self.created_fields, self.failed_operations
+
+    def _submit(self, group: List[UploadNode]):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._process, group)
+
+    def _process(self, group: List[UploadNode]):
+        try:
+            try:
+                done, to_push, fields, pending = self._push_records(group)
+            except Exception as e:
+                for node in group:
+                    self._fail(node, e)
+                return
+            for node in done + [node for node, *_ in to_push]:
+                for children in chunked(node.children, self.batch_size):
+                    self._submit(children)
+            try:
+                self._fields_pushed(to_push, fields, pending, self.batcher.push_fields(flatten(pending)))
+            except Exception as e:
+                self._fields_failed(to_push, e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._lock.notify_all()
+
+    def _push_records(self, group: List[UploadNode]):
+        """
+        Pushes the Records of sibling nodes
+
+        Returns:
+            tuple: unchanged nodes, then (see _records_pushed) the nodes whose Record exists, whose children
+            can be uploaded, with their Fields and the Fields still to push
+        """
+
+        done, to_push, new_records = self._prepare_group(group)
+        return (done,) + self._records_pushed(to_push, new_records,
+                                              self.batcher.push_records([record for _, record in new_records]))
+
+    def _prepare_group(self, group: List[UploadNode]):
+        """
+        Returns:
+            tuple: unchanged nodes, (node, record, journal entry, planned Field contents) to push and the
+            (node, record) still to create
+        """
+
+        done = []
+        to_push = []
+        for node in group:
+            status, entry = self.checkpoint.status(node) if self.checkpoint else (NODE_NEW, None)
+            with self._lock:
+                self.node_status[status] += 1
+            if status == NODE_UNCHANGED:
+                print(f"↷ {node.label} unchanged, skipping")
+                done.append(node)
+                self._settled()
+                continue
+
+            # planned before the Record is created, so a payload that cannot be pushed leaves nothing in ARIA
+            try:
+                contents = self.planner.plan(node.key, node.data)
+            except Exception as e:
+                self._fail(node, e, entry['record_id'] if entry else None)
+                continue
+            record = Record(self.bucket_id, 'Generic', node.record_name)
+            if entry:
+                record.id = entry['record_id']
+                print(f"↷ {node.node_type.capitalize()} record reused: {record.id}")
+            to_push.append((node, record, entry, contents))
+
+        new_records = [(node, record) for node, record, entry, _ in to_push if not entry]
+        return done, to_push, new_records
+
+    def _records_pushed(self, to_push, new_records, errors):
+        """
+        Returns:
+            tuple: (node, record, journal entry, planned contents) whose record exists, the list of Fields of each and, for each,
+            the Fields still to push (parts journaled by an interrupted run already have their id)
+        """
+
+        for (node, record), error in zip(new_records, errors):
+            if error:
+                self._fail(node, error)
+                continue
+            print(f"✓ {node.node_type.capitalize()} record created: {record.id}")
+            if self.checkpoint:
+                self.checkpoint.record_pushed(node, record.id)
+
+        pushed = [(node, record, entry, contents) for node, record, entry, contents in to_push if record.id]
+        fields = [self._fields(node, record, entry, contents) for node, record, entry, contents in pushed]
+        return pushed, fields, [[field for field in node_fields if field.id is None] for node_fields in fields]
+
+    def _fields(self, node: UploadNode, record: Record, entry: Optional[Dict[str, Any]],
+                contents: List[Dict[str, Any]]) -> List[Field]:
+        """
+        Returns:
+            list: the Fields of the node, one per planned content; parts of an incomplete node
+            that are in the journal get their existing id and are not pushed again
+        """
+
+        field_ids = split_field_ids(entry['field_id']) if entry and entry['content_hash'] == node.content_hash else []
+        if len(field_ids) != len(contents):
+            field_ids = [None] * len(contents)
+        if len(contents) == 1:
+            return [Field(record.id, 'JSON', contents[0], self._options(node, 0, 1), description=node.description,
+                          id=field_ids[0])]
+        print(f"↪ {node.label} split into {len(contents)} fields")
+        return [Field(record.id, 'JSON', content, self._options(node, part, len(contents)),
+                      description=f"{node.description or node.summary} (part {part + 1}/{len(contents)})",
+                      id=field_id)
+                for part, (content, field_id) in enumerate(zip(contents, field_ids))]
+
+    @staticmethod
+    def _options(node: UploadNode, part: int, parts: int) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Field options sent to ARIA, which tell apart the parts of a split payload and,
+            after --delta, the Fields of the current content from older ones on the same Record
+        """
+
+        return {'part': part + 1, 'parts': parts, 'content_hash': node.content_hash}
+
+    def _fields_pushed(self, to_push, fields, pending, errors):
+        errors = iter(errors)
+        for (node, record, entry, contents), node_fields, node_pending in zip(to_push, fields, pending):
+            error = next((e for e in [next(errors) for _ in node_pending] if e), None)
+            pushed = [field for field in node_pending if field.id]
+            metrics.increment('field_bytes', sum(payload_size(content) for field, content in zip(node_fields, contents)
+                                                 if field in pushed))
+            # one slot per part, empty for the parts still missing
+            field_id = ','.join(str(field.id or '') for field in node_fields)
+            if pushed and self.checkpoint:
+                self.checkpoint.field_pushed(node, record.id, field_id)
+
+            with self._lock:
+                if not entry:
+                    self.created_records.append(dict(node.detail, record_id=record.id))
+                self.created_fields.extend({
+                    'record_id': record.id,
+                    'field_id': field.id,
+                    'field_type': 'JSON',
+                    'description': node.summary if len(node_fields) == 1 else field.description
+                } for field in pushed)
+            if error:
+                self._fail(node, error, record.id, field_id if pushed else None, subtree=False)
+                continue
+            print(f"✓ {node.node_type.capitalize()} field created: {field_id}")
+            with self._lock:
+                self.results.append(self._result(node, RESULT_UPDATED if entry else RESULT_CREATED, record.id,
+                                                 field_id))
+            self._settled()
+
+    def _fields_failed(self, to_push, error: Exception):
+        """Fails the nodes whose Fields could not be pushed at all; their children are already scheduled"""
+        for node, record, entry, _ in to_push:
+            if not entry:
+                with self._lock:
+                    self.created_records.append(dict(node.detail, record_id=record.id))
+            self._fail(node, error, record.id, subtree=False)
+
+    def _fail(self, node: UploadNode, error: Exception, record_id: Optional[str] = None,
+              field_id: Optional[str] = None, subtree: bool = True):
+        with self._lock:
+            self.failed_operations.append(f"{node.label}: {str(error)}")
+            self.results.append(self._result(node, RESULT_FAILED, record_id, field_id, error=str(error)))
+        print(f"✗ Failed to process {node.label}: {error}")
+        # unless its Record exists and its children were scheduled, they will not be pushed either
+        self._settled(node.size() if subtree else 1)
+
+    def _settled(self, nodes: int = 1):
+        """
+        Counts nodes that are done with (pushed, unchanged or failed) and prints the
+        progress every 1/UPLOAD_PROGRESS_STEPS of the planned nodes
+        """
+
+        with self._lock:
+            self.nodes_settled += nodes
+            settled = self.nodes_settled
+        if not self.planned:
+            return
+        step = max(1, self.planned // UPLOAD_PROGRESS_STEPS)
+        previous = settled - nodes
+        if previous >= self.planned or (settled // step == previous // step and settled < self.planned):
+            return
+        settled = min(settled, self.planned)
+        elapsed = time.monotonic() - self._started
+        eta = elapsed / settled * (self.planned - settled)
+        print(f"⏱ {settled}/{self.planned} nodes ({100 * settled / self.planned:.0f}%), "
+              f"{elapsed:.1f}s elapsed, ETA {eta:.1f}s")
+
+    @staticmethod
+    def _result(node: UploadNode, status: str, record_id: Optional[str] = None, field_id: Optional[str] = None,
+                error: Optional[str] = None) -> Dict[str, Any]:
+        return {'node_key': node.key, 'node_type': node.node_type, 'record_id': record_id, 'field_id': field_id,
+                'status': status, 'error': error}
+
+
+class AsyncUploadEngine(UploadEngine):
+    """
+    UploadEngine running on an event loop: each group of sibling nodes is a task, at most
+    workers of them push at the same time, and the children of a node are scheduled as
+    soon as its Record exists. Use it with an AsyncPushBatcher.
+    """
+
+    async def run(self, nodes: Iterable[UploadNode]):
+        """
+        Uploads every node and waits until the whole tree has been processed
+
+        Args:
+            nodes (iterable): root nodes (samples) of the upload tree
+
+        Returns:
+            tuple: created records, created fields and failed operations
+        """
+
+        self._semaphore = asyncio.Semaphore(self.workers)
+        roots = set()
+        for group in chunked(nodes, self.batch_size):
+            # roots are read lazily: only take the next samples once the queue has room
+            while len(roots) >= self.workers * 2:
+                _, roots = await asyncio.wait(roots, return_when=asyncio.FIRST_COMPLETED)
+            roots.add(asyncio.ensure_future(self._process_async(group)))
+        if roots:
+            await asyncio.wait(roots)
+        return self.created_records, self.created_fields, self.failed_operations
+
+    async def _process_async(self, group: List[UploadNode]):
+        try:
+            async with self._semaphore:
+                done, to_push, fields, pending = await self._push_records_async(group)
+        except Exception as e:
+            for node in group:
+                self._fail(node, e)
+            return
+        children = [asyncio.ensure_future(self._process_async(children))
+                    for node in done + [node for node, *_ in to_push]
+                    for children in chunked(node.children, self.batch_size)]
+        try:
+            async with self._semaphore:
+                self._fields_pushed(to_push, fields, pending, await self.batcher.push_fields(flatten(pending)))
+        except Exception as e:
+            self._fields_failed(to_push, e)
+        await asyncio.gather(*children)
+
+    async def _push_records_async(self, group: List[UploadNode]):
+        done, to_push, new_records = self._prepare_group(group)
+        return (done,) + self._records_pushed(to_push, new_records,
+                                              await self.batcher.push_records([record for _, record in new_records]))
@@ -0,0 +1,211 @@
+import hashlib
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+from nmrcerm.constants import MAX_VALIDATION_MESSAGES
+
+
+class ExportValidationError(ValueError):
+    """
+    Raised at the end of a validation pass when the export cannot be uploaded as it is
+    """
+
+    def __init__(self, errors: List[str], error_count: int):
+        self.errors = errors
+        self.error_count = error_count
+        more = f"\n  ... and {error_count - len(errors)} more" if error_count > len(errors) else ''
+        super().__init__(f"invalid export, {error_count} error(s):\n  " + '\n  '.join(errors) + more)
+
+
+class SampleValidator:
+    """
+    Single pass over a samples export that checks the sample → dataset → experiment
+    structure the upload relies on (sample name, dataset id, experiment expno, JSON
+    serialisable values) and normalises it: repeated datasets and experiments with the
+    same content are dropped, the same key with a different content is an error. While
+    doing so it counts the nodes of the upload tree. Each node is one Record and at least
+    one Field (more if its payload is split), unless --delta/--resume finds it unchanged.
+    """
+
+    def __init__(self, max_messages: int = MAX_VALIDATION_MESSAGES):
+        self.max_messages = max_messages
+        self.samples = 0
+        self.datasets = 0
+        self.experiments = 0
+        self.duplicates = 0
+        self.errors = []
+        self.warnings = []
+        self.error_count = 0
+        self.warning_count = 0
+        self._seen = 0
+        self._sample_hashes = {}
+
+    @property
+    def nodes(self) -> int:
+        return self.samples + self.datasets + self.experiments
+
+    def validate(self, samples: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the normalised samples, then raises ExportValidationError if any was invalid
+        """
+
+        for sample in samples:
+            sample = self.normalise(sample)
+            if sample is not None:
+                yield sample
+        self.raise_for_errors()
+
+    async def validate_async(self, samples: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Same as validate, for samples read from an async iterator"""
+        async for sample in samples:
+            sample = self.normalise(sample)
+            if sample is not None:
+                yield sample
+        self.raise_for_errors()
+
+    def check(self, samples: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Function that validates a whole export without keeping it
+
+        Returns:
+            dict: upload plan (see summary)
+
+        Raises:
+            ExportValidationError: the export has errors
+        """
+
+        for _ in self.validate(samples):
+            pass
+        return self.summary()
+
+    def normalise(self, sample: Any) -> Optional[Dict[str, Any]]:
+        """
+        Function that validates one sample and drops its repeated datasets and experiments
+
+        Returns:
+            dict: the sample to upload, None if it is invalid or a repetition of a previous one
+        """
+
+        self._seen += 1
+        position = self._seen
+        if not isinstance(sample, dict):
+            self._error(f"sample #{position} is a {type(sample).__name__}, not an object")
+            return None
+        name = sample.get('name')
+        if name in (None, '') or isinstance(name, (dict, list)):
+            self._error(f"sample #{position} has no valid name")
+            return None
+        where = f"sample {name}"
+        sample_hash = self._hash(sample, where)
+        if sample_hash is None:
+            return None
+        previous_hash = self._sample_hashes.get(name)
+        if previous_hash is not None:
+            if previous_hash != sample_hash:
+                self._error(f"{where} appears twice with different content")
+            else:
+                self.duplicates += 1
+            return None
+        self._sample_hashes[name] = sample_hash
+
+        experiment_dtos = sample.get('experimentDTO')
+        if experiment_dtos is not None and not isinstance(experiment_dtos, list):
+            self._error(f"{where}: experimentDTO is a {type(experiment_dtos).__name__}, not a list")
+            return None
+        if not experiment_dtos:
+            self._warning(f"{where} has no experimentDTO, only the sample record will be uploaded")
+
+        datasets = self._unique(experiment_dtos or [], 'id', 'dataset', where, self._normalise_dataset)
+        if datasets is None:
+            return None
+        if experiment_dtos is not None and len(datasets) != len(experiment_dtos):
+            sample = dict(sample, experimentDTO=datasets)
+
+        self.samples += 1
+        self.datasets += len(datasets)
+        self.experiments += sum(len(dataset.get('experimentList') or []) for dataset in datasets)
+        return sample
+
+    def _normalise_dataset(self, dataset: Dict[str, Any], where: str) -> Optional[Dict[str, Any]]:
+        experiments = dataset.get('experimentList')
+        if experiments is None:
+            return dataset
+        if not isinstance(experiments, list):
+            self._error(f"{where}: experimentList is a {type(experiments).__name__}, not a list")
+            return None
+        unique = self._unique(experiments, 'expno', 'experiment', where, lambda experiment, _: experiment)
+        if unique is None:
+            return None
+        return dataset if len(unique) == len(experiments) else dict(dataset, experimentList=unique)
+
+    def _unique(self, items: List[Any], key: str, item_type: str, where: str, normalise) -> Optional[List[Any]]:
+        """
+        Returns:
+            list: items without repetitions, None if one of them is invalid or two conflict
+        """
+
+        unique = {}
+        valid = True
+        for position, item in enumerate(items, start=1):
+            if not isinstance(item, dict):
+                self._error(f"{where}: {item_type} #{position} is a {type(item).__name__}, not an object")
+                valid = False
+                continue
+            item_id = item.get(key)
+            if item_id in (None, '') or isinstance(item_id, (dict, list)):
+                self._error(f"{where}: {item_type} #{position} has no valid {key}")
+                valid = False
+                continue
+            item = normalise(item, f"{where}, {item_type} {item_id}")
+            if item is None:
+                valid = False
+                continue
+            if item_id not in unique:
+                unique[item_id] = item
+            elif unique[item_id] == item:
+                self.duplicates += 1
+            else:
+                self._error(f"{where}: {item_type} {key}={item_id} appears twice with different content")
+                valid = False
+        return list(unique.values()) if valid else None
+
+    def _hash(self, sample: Dict[str, Any], where: str) -> Optional[str]:
+        """
+        Returns:
+            str: sha256 of the canonical JSON encoding of the sample, None if it has values
+            JSON cannot encode (bytes, NaN, infinity...)
+        """
+
+        try:
+            encoded = json.dumps(sample, sort_keys=True, separators=(',', ':'), allow_nan=False)
+        except (TypeError, ValueError) as e:
+            self._error(f"{where} is not JSON serialisable: {e}")
+            return None
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _error(self, message: str):
+        self.error_count += 1
+        if len(self.errors) < self.max_messages:
+            self.errors.append(message)
+
+    def _warning(self, message: str):
+        self.warning_count += 1
+        if len(self.warnings) < self.max_messages:
+            self.warnings.append(message)
+
+    def raise_for_errors(self):
+        if self.error_count:
+            raise ExportValidationError(self.errors, self.error_count)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: nodes per type and in total, repetitions dropped, warnings and errors
+        """
+
+        return {'samples': self.samples,
+                'datasets': self.datasets,
+                'experiments': self.experiments,
+                'nodes': self.nodes,
+                'duplicates_removed': self.duplicates,
+                'warnings': self.warning_count,
+                'errors': self.error_count}
@@ -20,6 +20,11 @@ setup(
     author_email='isanchez@cnb.csic.es, lui.holliday@instruct-eric.org, marcus@instruct-eric.org, yvonne.de.jong-leung@instruct-eric.org, andrea.giachetti@protonmail.com',
     packages=find_packages(),
     install_requires=[requirements],
+    extras_require={
+        'zstd': ['zstandard'],
+        'msgpack': ['msgpack>=1.0'],
+        'async': ['aiohttp>=3.8'],
+    },
     entry_points={
         'fandango.plugin': 'fandanGO-nmr-cerm = nmrcerm'
     },